@@ -4,12 +4,15 @@ from discord_slash import cog_ext, SlashContext, ComponentContext
 from discord_slash.utils.manage_commands import create_option, SlashCommandOptionType, create_permission
 from discord_slash.utils.manage_components import create_select, create_select_option, spread_to_rows, create_button, wait_for_component
 from discord_slash.model import SlashCommandPermissionType, ButtonStyle, ComponentType
-from rating_utils import create_player
-from glicko2 import Player
+from rating_utils import create_player, period_sums, rate_period
+from maplist_utils import new_map_seed, generate_seeded_maps
+from game_state import GameStateStore
+from match_pool import add_overwrites, TEXT_OVERWRITE, VOICE_OVERWRITE
+from request_scheduler import NORMAL
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import json, logging, asyncio, pytz, random, os
+import json, logging, asyncio, pytz, heapq
 
 from typing import Union
 
@@ -22,27 +25,37 @@ with open("./data/maps.json", "r") as f:
 with open("./data/modes.json", "r") as f:
     mode_key = json.load(f)
 
-MAPLIST_LUCK = 3 # the higher the number, the more good maps and the less bad maps
+CLOSE_RETRY_SECONDS = 60
+CLOSE_RECOVERY_MINUTES = 5 # submissions are scheduled from events, this is only a safety net
 
 
 class Game(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.close_heap = [] # (submit_time, game id)
+        self.close_deadlines = {} # game id -> submit_time, entries in the heap that don't match this are stale
+        self.close_wakeup = asyncio.Event()
+        self.game_states = GameStateStore() # active games for the score reporting buttons
         self.close_games_loop.start()
+        self.recover_closes.start()
+        self.bot.event_bus.subscribe('games', self.on_games_event)
+        self.bot.event_bus.subscribe('games', self.game_states.on_games_event)
 
     def cog_unload(self):
         self.close_games_loop.cancel()
+        self.recover_closes.cancel()
+        self.bot.event_bus.unsubscribe('games', self.on_games_event)
+        self.bot.event_bus.unsubscribe('games', self.game_states.on_games_event)
 
 
-    async def send_match_result(self, player_id, old_rating, won, game, mode, match_draw, is_bravo):
+    async def send_match_result(self, player_id, old_rating, new_rating, won, game, mode, match_draw, is_bravo):
         guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
         member = discord.utils.get(guild.members, id=player_id)
         if not member:
             return
         
-        ratings = await self.bot.pg_con.fetchrow("SELECT user_id, mode, rating FROM ratings WHERE user_id = $1 AND mode = $2", player_id, game['mode'])
-        change = '{:.1f}'.format(ratings['rating'] - old_rating)
+        change = '{:.1f}'.format(new_rating - old_rating)
         if change[0] != "-":
             change = "+" + change
 
@@ -83,103 +96,103 @@ class Game(commands.Cog):
         await channel.send(embed=embed)
 
 
-    async def close_game(self, game):
+    async def close_game(self, id):
         try:
             guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
-            mode = await self.bot.pg_con.fetchrow("SELECT * FROM modes WHERE internal_name = $1", game['mode'])
     
-            # calculate score
-            alpha = 0
-            bravo = 0
-            for score in game['score']:
-                if score == 1:
-                    alpha += 1
-                elif score == 2:
-                    bravo += 1
+            # claim the game, calculate ratings and close it in one transaction so it is closed exactly once and a failed close leaves nobody rated
+            async with self.bot.pg_con.acquire() as con:
+                async with con.transaction():
+                    now = pytz.utc.localize(datetime.utcnow())
+                    game = await con.fetchrow(
+                        "UPDATE games SET game_active = false, end_date = $2 WHERE id = $1 AND game_active = true AND submit_time <= $2 RETURNING *",
+                        id, now
+                    )
+                    if not game: # already closed, or the submission was cancelled
+                        return
+                    self.game_states.invalidate(id)
+                    mode = self.bot.mode_registry.get(game['mode'])
+
+                    # calculate score
+                    alpha = 0
+                    bravo = 0
+                    for score in game['score']:
+                        if score == 1:
+                            alpha += 1
+                        elif score == 2:
+                            bravo += 1
             
-            if not mode['play_all_games']:
-                points_to_win = mode['games'] // 2 + 1
-                match_draw = alpha < points_to_win and bravo < points_to_win
-            else:
-                match_draw = alpha + bravo < mode['games']
-
-            if alpha > bravo:
-                alpha_won = True
-            elif bravo > alpha:
-                alpha_won = False
-            else:
-                alpha_won = True # this will do nothing if match_draw is true, but we still need to define it
-                match_draw = True
-
-            # calculate ratings
-            if alpha + bravo != 0: # if no games were played, don't change any ratings
-                alpha_ratings = 0
-                for rating in game['alpha_ratings']:
-                    alpha_ratings += rating
-
-                bravo_ratings = 0
-                for rating in game['bravo_ratings']:
-                    bravo_ratings += rating
-
-                def get_rd_list(player_rd):
-                    game_rd_list = []
-                    for rd in game['alpha_deviations']:
-                        game_rd_list.append(rd)
-                    for rd in game['bravo_deviations']:
-                        game_rd_list.append(rd)
-
-                    game_rd_list.remove(player_rd)
-                    return game_rd_list
-
-                for player_id in game['alpha_players']:
-                    rating = await self.bot.pg_con.fetchrow("SELECT * FROM ratings WHERE user_id = $1 AND mode = $2", player_id, game['mode'])
-                    game_rd_list = get_rd_list(rating['deviation'])
-                    if not (rating['rating_initial'] and rating['deviation_initial'] and rating['volatility_initial']):
-                        rating = await self.bot.pg_con.fetchrow(
-                            "UPDATE ratings SET rating_initial = rating, deviation_initial = deviation, volatility_initial = volatility WHERE user_id = $1 AND mode = $2 RETURNING *",
-                            player_id, game['mode']
-                        )
-                    
-                    new_ratings, new_rds, new_outcomes = create_player(alpha_ratings - rating['rating'], bravo_ratings, game_rd_list, alpha, bravo)
-                    rating_list = rating['rating_list'] + new_ratings
-                    rd_list = rating['deviation_list'] + new_rds
-                    outcome_list = rating['outcome_list'] + new_outcomes
-
-                    glicko_player = Player(rating=rating['rating_initial'], rd=rating['deviation_initial'], vol=rating['volatility_initial'])
-                    glicko_player.update_player(rating_list, rd_list, outcome_list)
-
-                    await self.bot.pg_con.execute(
-                        "UPDATE ratings SET rating = $3, deviation = $4, volatility = $5, rating_list = $6, deviation_list = $7, outcome_list = $8 WHERE user_id = $1 AND mode = $2",
-                        player_id, game['mode'], glicko_player.rating, glicko_player.rd, glicko_player.vol, rating_list, rd_list, outcome_list
+                    if not mode['play_all_games']:
+                        points_to_win = mode['games'] // 2 + 1
+                        match_draw = alpha < points_to_win and bravo < points_to_win
+                    else:
+                        match_draw = alpha + bravo < mode['games']
+
+                    if alpha > bravo:
+                        alpha_won = True
+                    elif bravo > alpha:
+                        alpha_won = False
+                    else:
+                        alpha_won = True # this will do nothing if match_draw is true, but we still need to define it
+                        match_draw = True
+
+                    player_ids = game['alpha_players'] + game['bravo_players']
+                    rows = await con.fetch(
+                        "SELECT * FROM ratings WHERE mode = $1 AND user_id = ANY ($2::bigint[]) FOR UPDATE",
+                        game['mode'], player_ids
                     )
-
-                for player_id in game['bravo_players']:
-                    rating = await self.bot.pg_con.fetchrow("SELECT * FROM ratings WHERE user_id = $1 AND mode = $2", player_id, game['mode'])
-                    game_rd_list = get_rd_list(rating['deviation'])
-                    if not (rating['rating_initial'] and rating['deviation_initial'] and rating['volatility_initial']):
-                        rating = await self.bot.pg_con.fetchrow(
-                            "UPDATE ratings SET rating_initial = rating, deviation_initial = deviation, volatility_initial = volatility WHERE user_id = $1 AND mode = $2 RETURNING *",
-                            player_id, game['mode']
+                    ratings = {}
+                    for row in rows:
+                        ratings[row['user_id']] = row
+
+                    new_ratings = {}
+                    for player_id in player_ids:
+                        new_ratings[player_id] = ratings[player_id]['rating']
+
+                    if alpha + bravo != 0: # if no games were played, don't change any ratings
+                        alpha_ratings = sum(game['alpha_ratings'])
+                        bravo_ratings = sum(game['bravo_ratings'])
+                        game_rd_list = game['alpha_deviations'] + game['bravo_deviations']
+
+                        updates = ([], [], [], [], [], [], [], [], [])
+                        for i in range(len(player_ids)):
+                            player_id = player_ids[i]
+                            rating = ratings[player_id]
+                            is_bravo = i >= len(game['alpha_players'])
+
+                            # the player's own deviation is not part of the game's rd list
+                            player_rd_list = game_rd_list[:i] + game_rd_list[i+1:]
+
+                            rating_initial = rating['rating_initial']
+                            deviation_initial = rating['deviation_initial']
+                            volatility_initial = rating['volatility_initial']
+                            if not (rating_initial and deviation_initial and volatility_initial):
+                                rating_initial, deviation_initial, volatility_initial = rating['rating'], rating['deviation'], rating['volatility']
+
+                            if not is_bravo:
+                                new_list = create_player(alpha_ratings - rating['rating'], bravo_ratings, player_rd_list, alpha, bravo)
+                            else:
+                                new_list = create_player(bravo_ratings - rating['rating'], alpha_ratings, player_rd_list, bravo, alpha)
+                            variance_sum, improvement_sum = period_sums(rating_initial, *new_list)
+                            variance_sum += rating['variance_sum']
+                            improvement_sum += rating['improvement_sum']
+
+                            new_rating, new_rd, new_vol = rate_period(rating_initial, deviation_initial, volatility_initial, variance_sum, improvement_sum)
+                            new_ratings[player_id] = new_rating
+
+                            values = (player_id, new_rating, new_rd, new_vol, rating_initial, deviation_initial, volatility_initial, variance_sum, improvement_sum)
+                            for column, value in zip(updates, values):
+                                column.append(value)
+
+                        await con.execute(
+                            """UPDATE ratings SET rating = new.rating, deviation = new.deviation, volatility = new.volatility,
+                            rating_initial = new.rating_initial, deviation_initial = new.deviation_initial, volatility_initial = new.volatility_initial,
+                            variance_sum = new.variance_sum, improvement_sum = new.improvement_sum
+                            FROM unnest($2::bigint[], $3::float8[], $4::float8[], $5::float8[], $6::float8[], $7::float8[], $8::float8[], $9::float8[], $10::float8[])
+                            AS new (user_id, rating, deviation, volatility, rating_initial, deviation_initial, volatility_initial, variance_sum, improvement_sum)
+                            WHERE ratings.mode = $1 AND ratings.user_id = new.user_id""",
+                            game['mode'], *updates
                         )
-                    
-                    new_ratings, new_rds, new_outcomes = create_player(bravo_ratings - rating['rating'], alpha_ratings, game_rd_list, bravo, alpha)
-                    rating_list = rating['rating_list'] + new_ratings
-                    rd_list = rating['deviation_list'] + new_rds
-                    outcome_list = rating['outcome_list'] + new_outcomes
-
-                    glicko_player = Player(rating=rating['rating_initial'], rd=rating['deviation_initial'], vol=rating['volatility_initial'])
-                    glicko_player.update_player(rating_list, rd_list, outcome_list)
-
-                    await self.bot.pg_con.execute(
-                        "UPDATE ratings SET rating = $3, deviation = $4, volatility = $5, rating_list = $6, deviation_list = $7, outcome_list = $8 WHERE user_id = $1 AND mode = $2",
-                        player_id, game['mode'], glicko_player.rating, glicko_player.rd, glicko_player.vol, rating_list, rd_list, outcome_list
-                    )
-
-            # mark game as closed
-            await self.bot.pg_con.execute(
-                "UPDATE games SET game_active = false, end_date = $2 WHERE id = $1",
-                game['id'], pytz.utc.localize(datetime.utcnow())
-            )
 
             # delete channels
             category = discord.utils.get(guild.channels, name=f"match #{game['id']}")
@@ -191,28 +204,60 @@ class Game(commands.Cog):
                 )
             await asyncio.gather(*coroutines)
             await category.delete(reason=reason)
+            self.bot.match_pool.replenish(guild)
 
             # send messages
             i = 0
             for player_id in game['alpha_players']:
-                asyncio.create_task(self.send_match_result(player_id, game['alpha_ratings'][i], alpha_won, game, mode, match_draw, False))
+                self.bot.scheduler.submit(NORMAL, f"dm:{player_id}", lambda player_id=player_id, i=i: self.send_match_result(
+                    player_id, game['alpha_ratings'][i], new_ratings[player_id], alpha_won, game, mode, match_draw, False
+                ))
                 i += 1
             
             i = 0
             for player_id in game['bravo_players']:
-                asyncio.create_task(self.send_match_result(player_id, game['bravo_ratings'][i], not alpha_won, game, mode, match_draw, True))
+                self.bot.scheduler.submit(NORMAL, f"dm:{player_id}", lambda player_id=player_id, i=i: self.send_match_result(
+                    player_id, game['bravo_ratings'][i], new_ratings[player_id], not alpha_won, game, mode, match_draw, True
+                ))
                 i += 1
         
         except Exception as error:
             logging.exception("Closing game error!", exc_info=error)
+            self.schedule_close(id, pytz.utc.localize(datetime.utcnow())+relativedelta(seconds=CLOSE_RETRY_SECONDS))
+
 
+    def schedule_close(self, id, submit_time):
+        self.close_deadlines[id] = submit_time
+        heapq.heappush(self.close_heap, (submit_time, id))
+        self.close_wakeup.set()
 
-    @tasks.loop(seconds=3)
+    def cancel_close(self, id):
+        self.close_deadlines.pop(id, None)
+
+    async def on_games_event(self, event):
+        if event['op'] != 'DELETE' and event['game_active'] and event['submit_time'] is not None:
+            self.schedule_close(event['id'], datetime.fromtimestamp(event['submit_time'], pytz.utc))
+        else:
+            self.cancel_close(event['id'])
+
+
+    @tasks.loop()
     async def close_games_loop(self):
-        time = pytz.utc.localize(datetime.utcnow())
-        games = await self.bot.pg_con.fetch("SELECT * FROM games WHERE submit_time <= $1 AND game_active = true", time)
-        for game in games:
-            asyncio.create_task(self.close_game(game))
+        # close every game that is due, then sleep until the next deadline or until a new one is scheduled
+        now = pytz.utc.localize(datetime.utcnow())
+        while self.close_heap and self.close_heap[0][0] <= now:
+            submit_time, id = heapq.heappop(self.close_heap)
+            if self.close_deadlines.get(id) != submit_time:
+                continue
+            del self.close_deadlines[id]
+            asyncio.create_task(self.close_game(id))
+
+        timeout = (self.close_heap[0][0] - now).total_seconds() if self.close_heap else None
+        self.close_wakeup.clear()
+        try:
+            await asyncio.wait_for(self.close_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
     
     @close_games_loop.before_loop
     async def before_game_closer(self):
@@ -226,62 +271,35 @@ class Game(commands.Cog):
         await asyncio.sleep(120)
         self.close_games_loop.start()
 
+    @tasks.loop(minutes=CLOSE_RECOVERY_MINUTES)
+    async def recover_closes(self):
+        # pick up submitted games from before a restart or from missed events
+        games = await self.bot.pg_con.fetch("SELECT id, submit_time FROM games WHERE submit_time IS NOT NULL AND game_active = true")
+        for game in games:
+            if self.close_deadlines.get(game['id']) != game['submit_time']:
+                self.schedule_close(game['id'], game['submit_time'])
 
-    def generate_maps(self, modes, maplist):
-
-        def remove_items(test_list, item):
-            # using list comprehension to perform the task
-            res = [i for i in test_list if i != item]
-            return res
-
-        with open(f"./data/maplists/{maplist}.json") as f:
-            data = json.load(f)
-
-        map_pool = {}
-        generated_maps = []
-        generated_modes = []
-        # generate map pool
-        for mode in modes:
-            if mode in map_pool:
-                continue
+    @recover_closes.before_loop
+    async def before_recover_closes(self):
+        await self.bot.wait_until_ready()
 
-            map_pool[mode] = []
-            for map in data:
-                for i in range(data[map][mode] ** MAPLIST_LUCK):
-                    map_pool[mode].append(map)
-        
-        # pick maps
-        for mode in modes:
-            chosen_map = random.choice(map_pool[mode])
-            for key in map_pool:
-                map_pool[key] = remove_items(map_pool[key], chosen_map)
-            generated_maps.append(chosen_map)
-            generated_modes.append(mode)
-    
-        return generated_maps, generated_modes
+    @recover_closes.error
+    async def error_recover_closes(self, error):
+        logging.exception("Game close recovery error!", exc_info=error)
+        logging.error("Attempting to restart game close recovery in 2 minutes.")
+        await asyncio.sleep(120)
+        self.recover_closes.start()
 
 
     async def update_game_score(self, game, score_id):
-        index = 0
-        for score in game['score']:
-            if score == 0:
-                break
-            index += 1
-        
-        offset = 1 if score_id == 0 else 0 # if score_id is 0, undo the last score report
-
-        new_score = game['score']
-        new_score[index - offset] = score_id
-        await self.bot.pg_con.execute(
-            "UPDATE games SET score = $2 WHERE id = $1",
-            game['id'], new_score
-        )
+        # if score_id is 0, undo the last score report
+        # if someone else changed the score first, nothing is changed, None is returned and show_maps will show their change
+        return await self.game_states.change_score(self.bot.pg_con, game['id'], score_id, game['score_version'])
 
 
     async def show_maps(self, ctx: ComponentContext, id: int):
         try:
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
-            mode = await self.bot.pg_con.fetchrow("SELECT * FROM modes WHERE internal_name = $1", game['mode'])
+            game = await self.game_states.get(self.bot.pg_con, id)
 
             num = 0
             alpha = 0
@@ -303,11 +321,12 @@ class Game(commands.Cog):
                 num += 1
             
             match_complete = False
-            if not mode['play_all_games']:
-                points_to_win = mode['games'] // 2 + 1
+            games = len(game['score']) # the score has one entry for each game of the mode
+            if not game['play_all_games']:
+                points_to_win = games // 2 + 1
                 match_complete = alpha >= points_to_win or bravo >= points_to_win
             else:
-                match_complete = num >= mode['games']
+                match_complete = num >= games
     
             if not match_complete:
                 game_map = game['game_maps'][num]
@@ -396,15 +415,13 @@ class Game(commands.Cog):
 
 
     async def submit_score(self, ctx: Union[SlashContext, ComponentContext], id: int):
-        game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+        game = await self.game_states.get(self.bot.pg_con, id)
         if not await self.can_change_score(ctx, game):
                 return
             
         submit_time = pytz.utc.localize(datetime.utcnow())+relativedelta(seconds=+30)
-        await self.bot.pg_con.execute(
-            "UPDATE games SET submit_time = $2 WHERE id = $1",
-            game['id'], submit_time
-        )
+        await self.game_states.update(self.bot.pg_con, game['id'], submit_time=submit_time)
+        self.schedule_close(game['id'], submit_time)
 
         alpha = 0
         bravo = 0
@@ -476,7 +493,7 @@ class Game(commands.Cog):
             return
 
         id = int(category.name[7:])
-        game = await self.bot.pg_con.fetchrow("SELECT id, admin_locked, alpha_players, bravo_players FROM games WHERE id = $1", id)
+        game = await self.game_states.get(self.bot.pg_con, id)
         if not game['admin_locked']:
             await ctx.send("This match has already been resolved.", hidden=True)
             return
@@ -489,7 +506,7 @@ class Game(commands.Cog):
         )
 
         asyncio.create_task(ctx.send(embed=embed))
-        await self.bot.pg_con.execute("UPDATE games SET admin_locked = false WHERE id = $1", id)
+        await self.game_states.update(self.bot.pg_con, id, admin_locked=False)
 
         # only remove the admin from channels they shouldn't be in
         channels = category.channels
@@ -550,6 +567,8 @@ class Game(commands.Cog):
         logging.info(reason)
 
         asyncio.create_task(self.bot.pg_con.execute("DELETE FROM games WHERE id = $1", match_id))
+        self.cancel_close(match_id)
+        self.game_states.invalidate(match_id)
 
         if category:
             coroutines = []
@@ -559,6 +578,7 @@ class Game(commands.Cog):
                 )
             await asyncio.gather(*coroutines)
             await category.delete(reason=reason)
+            self.bot.match_pool.replenish(ctx.guild)
 
         await ctx.send("Delete successful!")
 
@@ -567,49 +587,54 @@ class Game(commands.Cog):
     async def on_component(self, ctx: ComponentContext):
         if ctx.custom_id[:14] == "generate_maps_":
             id = int(ctx.custom_id[14:])
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
 
             if not await self.can_change_score(ctx, game):
                 return
 
-            mode = await self.bot.pg_con.fetchrow("SELECT internal_name, maplist, format FROM modes WHERE internal_name = $1", game['mode'])
+            # maps are generated when the match is created, this is only for older matches
             if game['game_maps'] is None or game['game_modes'] is None:
-                game_maps, game_modes = self.generate_maps(mode['format'], mode['maplist'])
-                await self.bot.pg_con.execute(
-                    "UPDATE games SET game_maps = $2, game_modes = $3 WHERE id = $1",
-                    id, game_maps, game_modes
-                )
+                mode = self.bot.mode_registry.get(game['mode'])
+                map_seed = new_map_seed()
+                game_maps, game_modes = generate_seeded_maps(self.bot.maplists.get(mode['maplist']), mode['format'], map_seed)
+                await self.game_states.update(self.bot.pg_con, id, game_maps=game_maps, game_modes=game_modes, map_seed=map_seed)
             
             await self.show_maps(ctx, id)
         elif ctx.custom_id[:10] == "win_alpha_":
             id = int(ctx.custom_id[10:])
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
 
             if not await self.can_change_score(ctx, game):
                 return
             
-            await self.update_game_score(game, 1)
+            changed = await self.update_game_score(game, 1)
             await self.show_maps(ctx, id)
+            if not changed: # show_maps has to answer the click first, so this is a follow up
+                await ctx.send("Someone else changed the score first.", hidden=True)
         
         elif ctx.custom_id[:10] == "win_bravo_":
             id = int(ctx.custom_id[10:])
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
 
             if not await self.can_change_score(ctx, game):
                 return
             
-            await self.update_game_score(game, 2)
+            changed = await self.update_game_score(game, 2)
             await self.show_maps(ctx, id)
+            if not changed: # show_maps has to answer the click first, so this is a follow up
+                await ctx.send("Someone else changed the score first.", hidden=True)
 
         elif ctx.custom_id[:9] == "undo_map_":
             id = int(ctx.custom_id[9:])
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
 
             if not await self.can_change_score(ctx, game):
                 return        
 
-            await self.update_game_score(game, 0)
+            changed = await self.update_game_score(game, 0)
             await self.show_maps(ctx, id)
+            if not changed: # show_maps has to answer the click first, so this is a follow up
+                await ctx.send("Someone else changed the score first.", hidden=True)
         
         elif ctx.custom_id[:13] == "submit_score_":
             id = int(ctx.custom_id[13:])
@@ -617,7 +642,7 @@ class Game(commands.Cog):
         
         elif ctx.custom_id[:12] == "match_issue_":
             id = int(ctx.custom_id[12:])
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
             if game['admin_locked'] is True:
                 await ctx.send("A match issue has already been reported!", hidden=True)
                 return
@@ -635,7 +660,8 @@ class Game(commands.Cog):
                 description="An admin will be here shortly to resolve the issue."
             )
             asyncio.create_task(ctx.send(embed=embed))
-            await self.bot.pg_con.execute("UPDATE games SET admin_locked = true, submit_time = null WHERE id = $1", id)
+            await self.game_states.update(self.bot.pg_con, id, admin_locked=True, submit_time=None)
+            self.cancel_close(id)
 
             channel = discord.utils.get(ctx.guild.channels, name="match-issues")
             if not channel:
@@ -668,7 +694,7 @@ class Game(commands.Cog):
             components = spread_to_rows(assign_admin)
             asyncio.create_task(ctx.origin_message.edit(components=components))
 
-            game = await self.bot.pg_con.fetchrow("SELECT id, game_active FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
             if not game['game_active']:
                 await ctx.send("This match has already ended.", hidden=True)
                 return
@@ -684,12 +710,11 @@ class Game(commands.Cog):
             category = discord.utils.get(ctx.guild.categories, name=f"match #{id}")
             
             # add the admin user to all match channels
-            coroutines = []
-            for channel in category.text_channels:
-                coroutines.append(channel.set_permissions(ctx.author, view_channel=True))
-            for channel in category.voice_channels:
-                coroutines.append(channel.set_permissions(ctx.author, view_channel=True, connect=True))
-            await asyncio.gather(*coroutines)
+            overwrites = []
+            for channel in category.channels:
+                overwrite = VOICE_OVERWRITE if isinstance(channel, discord.VoiceChannel) else TEXT_OVERWRITE
+                overwrites.append({ctx.author: overwrite})
+            await add_overwrites(category.channels, overwrites)
 
             await category.text_channels[0].send(content=ctx.author.mention, embed=embed)
     
@@ -710,7 +735,7 @@ class Game(commands.Cog):
             components = spread_to_rows(cancel_submit)
             asyncio.create_task(ctx.origin_message.edit(components=components))
 
-            game = await self.bot.pg_con.fetchrow("SELECT * FROM games WHERE id = $1", id)
+            game = await self.game_states.get(self.bot.pg_con, id)
             if not game['submit_time']:
                 asyncio.create_task(ctx.send("The score is not submitted.", hidden=True))
                 return
@@ -720,7 +745,8 @@ class Game(commands.Cog):
                 await ctx.send("The match has already been submitted!", hidden=True)
                 return
             
-            await self.bot.pg_con.execute("UPDATE games SET submit_time = null WHERE id = $1", id)
+            await self.game_states.update(self.bot.pg_con, id, submit_time=None)
+            self.cancel_close(id)
 
             embed = discord.Embed(
                 colour = discord.Colour.red(),
@@ -3,30 +3,45 @@ from discord.errors import HTTPException
 from discord.ext import commands, tasks
 from discord_slash import cog_ext, SlashContext, ComponentContext
 from discord_slash.utils.manage_commands import create_option, SlashCommandOptionType, create_permission
-from discord_slash.utils.manage_components import create_select, create_select_option, spread_to_rows, create_button, wait_for_component
+from discord_slash.utils.manage_components import create_select, create_select_option, spread_to_rows, create_button
 from discord_slash.model import SlashCommandPermissionType, ButtonStyle, ComponentType
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import json, logging, asyncio, pytz
 
+from maplist_utils import new_map_seed, generate_seeded_maps
+from rating_utils import load_ratings
+from team_balance import balance_teams
+from queue_engine import SearchCurve
+from match_pool import match_overwrites
+from request_scheduler import CRITICAL, NORMAL, LOW
+
 with open("bot.json", "r") as f:
     bot_data = json.load(f)
 
-MODE_CACHE_SECONDS = 10
+QUEUE_SYNC_SECONDS = 300 # the queue engine is kept up to date by the cogs and queue events, this is only a safety net
 
 
 class Matchmaker(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.next_queue_sync = datetime.utcnow()
         self.matchmaker.start()
+        self.bot.event_bus.subscribe('queue', self.on_queue_event)
+        self.bot.event_bus.subscribe_reconnect(self.on_event_bus_reconnect)
+        self.bot.mode_registry.subscribe(self.on_modes_event)
 
     def cog_unload(self):
         self.matchmaker.cancel()
+        self.bot.event_bus.unsubscribe('queue', self.on_queue_event)
+        self.bot.event_bus.unsubscribe_reconnect(self.on_event_bus_reconnect)
+        self.bot.mode_registry.unsubscribe(self.on_modes_event)
 
 
-    async def send_ready_message(self, player: discord.User, mode):
+    async def send_ready_message(self, player: discord.User, mode, abort: asyncio.Event):
+        # returns True if accepted, False if not accepted in time and None if abort was set first
         channel = player.dm_channel
         if not channel:
             channel = await player.create_dm()
@@ -51,29 +66,70 @@ class Matchmaker(commands.Cog):
         
         embed.add_field(name="You have **20 seconds** to accept the match.", value="Do not accept the match if you cannot play for up to 45 minutes.")
 
-        msg = await channel.send(embed=embed, components=generate_components(False, ButtonStyle.green))
-
+        route = f"dm:{player.id}"
         try:
-            comp_ctx = await wait_for_component(self.bot, msg, timeout=20.0)
-        except asyncio.TimeoutError:
-            await msg.edit(embed=embed, components=generate_components(True, ButtonStyle.red))
+            msg = await self.bot.scheduler.run(CRITICAL, route, lambda: channel.send(embed=embed, components=generate_components(False, ButtonStyle.green)))
+        except HTTPException: # the player can't be messaged so they can't accept
             return False
-        else:
-            await comp_ctx.edit_origin(embed=embed, components=generate_components(True, ButtonStyle.green))
+
+        wait = asyncio.create_task(self.bot.router.wait_for_component(msg, timeout=20.0))
+        aborted = asyncio.create_task(abort.wait())
+        done, pending = await asyncio.wait((wait, aborted), return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+        if wait in done and not wait.cancelled() and not wait.exception():
+            await wait.result().edit_origin(embed=embed, components=generate_components(True, ButtonStyle.green))
             return True
+        elif wait in done: # timed out
+            await self.bot.scheduler.run(CRITICAL, route, lambda: msg.edit(embed=embed, components=generate_components(True, ButtonStyle.red)))
+            return False
+        else:
+            await self.bot.scheduler.run(CRITICAL, route, lambda: msg.edit(embed=embed, components=generate_components(True, ButtonStyle.gray)))
+            return None
 
 
-    async def send_info_message(self, player: discord.User, content):
-        channel = player.dm_channel
-        if not channel:
-            channel = await player.create_dm()
+    async def ready_check(self, players: list[discord.User], mode):
+        # stops waiting on everyone as soon as one player fails to accept
+        abort = asyncio.Event()
+
+        async def check(player):
+            ready = await self.send_ready_message(player, mode, abort)
+            if ready is False:
+                abort.set()
+            return ready
+
+        return await asyncio.gather(*[check(player) for player in players])
+
 
-        await channel.send(content=content)
+    def send_info_message(self, player: discord.User, content):
+        # queued without waiting, so nothing after it is held up behind the normal lane
+        async def send():
+            channel = player.dm_channel
+            if not channel:
+                channel = await player.create_dm()
+            await channel.send(content=content)
 
+        self.bot.scheduler.submit(NORMAL, f"dm:{player.id}", send)
 
-    async def initialize_match(self, players: list[discord.User], mode, host: discord.user):
-        # split the players
-        if not len(players) == 2: # TODO: Remove later once testing with two is no longer needed
+
+    async def initialize_match(self, players: list[discord.User], mode, host: discord.user, parties=(), balance=False):
+        # grab rating info
+        ratings = await load_ratings(self.bot.pg_con, [player.id for player in players], mode['internal_name'])
+
+        # queue matches are split into the most even teams, keeping parties together
+        if balance and len(players) == 8:
+            indexes = {player.id: i for i, player in enumerate(players)}
+            alpha_indexes, bravo_indexes, quality = balance_teams(
+                [ratings[player.id]['rating'] for player in players],
+                [ratings[player.id]['deviation'] for player in players],
+                [[indexes[player_id] for player_id in party if player_id in indexes] for party in parties],
+                players.index(host)
+            )
+            alpha = [players[i] for i in alpha_indexes]
+            bravo = [players[i] for i in bravo_indexes]
+            logging.info(f"Split players for a {mode['internal_name']} match with a quality of {quality:.3f}.")
+        elif not len(players) == 2: # TODO: Remove later once testing with two is no longer needed
             alpha = players[:4]
             bravo = players[4:]
         else:
@@ -99,85 +155,34 @@ class Matchmaker(commands.Cog):
         
         host_id = host.id
 
-        # grab rating info
-        async def grab_player_data(player): # TODO: make this a util function since it's directly copied from modes.py
-            ratings = await self.bot.pg_con.fetchrow(
-                    "SELECT user_id, mode, rating, deviation, volatility FROM ratings WHERE user_id = $1 AND mode = $2",
-                    player.id, mode['internal_name']
-                )
-            if not ratings:
-                ratings = await self.bot.pg_con.fetchrow(
-                    "INSERT INTO ratings (user_id, mode, rating, deviation, volatility) VALUES ($1, $2, $3, $4, $5) RETURNING rating, deviation, volatility",
-                    player.id, mode['internal_name'], 1500.0, 350.0, 0.06
-                )
-            return ratings
-
-        alpha_ratings = []
-        alpha_deviations = []
-        alpha_volatilities = []
-
-        for player in alpha:
-            p_data = await grab_player_data(player)
-            alpha_ratings.append(p_data['rating'])
-            alpha_deviations.append(p_data['deviation'])
-            alpha_volatilities.append(p_data['volatility'])
-        
-        bravo_ratings = []
-        bravo_deviations = []
-        bravo_volatilities = []
+        alpha_ratings = [ratings[player_id]['rating'] for player_id in alpha_players]
+        alpha_deviations = [ratings[player_id]['deviation'] for player_id in alpha_players]
+        alpha_volatilities = [ratings[player_id]['volatility'] for player_id in alpha_players]
 
-        for player in bravo:
-            p_data = await grab_player_data(player)
-            bravo_ratings.append(p_data['rating'])
-            bravo_deviations.append(p_data['deviation'])
-            bravo_volatilities.append(p_data['volatility'])
+        bravo_ratings = [ratings[player_id]['rating'] for player_id in bravo_players]
+        bravo_deviations = [ratings[player_id]['deviation'] for player_id in bravo_players]
+        bravo_volatilities = [ratings[player_id]['volatility'] for player_id in bravo_players]
 
         # generate score list for how many games in the mode
         score = [0] * mode['games']
 
+        # generate the maps now so revealing them is instant, the seed is kept so the maps can be reproduced
+        map_seed = new_map_seed()
+        game_maps, game_modes = generate_seeded_maps(self.bot.maplists.get(mode['maplist']), mode['format'], map_seed)
+
         # create the database once all data is gathered
         # id, alpha_players, bravo_players, mode, host, game_maps, game_modes, admin_locked, score, alpha_ratings, alpha_deviations, alpha_volatilities, bravo_ratings, bravo_deviations, bravo_volatilities
         # TODO: add alpha and bravo group data
         game_data = await self.bot.pg_con.fetchrow(
-            """INSERT INTO games (alpha_players, bravo_players, mode, host, score, start_date, alpha_ratings, alpha_deviations, alpha_volatilities, bravo_ratings, bravo_deviations, bravo_volatilities)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12) RETURNING id""",
-            alpha_players, bravo_players, mode['internal_name'], host_id, score, pytz.utc.localize(datetime.utcnow()), alpha_ratings, alpha_deviations, alpha_volatilities, bravo_ratings, bravo_deviations, bravo_volatilities
+            """INSERT INTO games (alpha_players, bravo_players, mode, host, score, start_date, alpha_ratings, alpha_deviations, alpha_volatilities, bravo_ratings, bravo_deviations, bravo_volatilities, game_maps, game_modes, map_seed)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15) RETURNING id""",
+            alpha_players, bravo_players, mode['internal_name'], host_id, score, pytz.utc.localize(datetime.utcnow()), alpha_ratings, alpha_deviations, alpha_volatilities, bravo_ratings, bravo_deviations, bravo_volatilities, game_maps, game_modes, map_seed
         )
 
         # build the channels
         guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
-        template_category = discord.utils.get(guild.categories, name="match template")
-
         reason = f"Creating game #{game_data['id']}."
-
-        category = await template_category.clone(name=f"match #{game_data['id']}", reason=reason)
-        coroutines = []
-        for channel in template_category.channels:
-            coroutines.append(
-                channel.clone(reason=reason)
-            )
-        channels = await asyncio.gather(*coroutines)
-
-        # move
-        for channel in channels:
-            await channel.move(category=category, end=True, reason=reason)
-        
-        # set permissions
-        async def set_text_perms(channel, players):
-            for player in players:
-                await channel.set_permissions(player, view_channel=True)
-
-        async def set_voice_perms(channel, players):
-            for player in players:
-                await channel.set_permissions(player, view_channel=True, connect=True)
-
-        await asyncio.gather(
-            set_text_perms(channels[0], alpha + bravo),
-            set_text_perms(channels[1], alpha),
-            set_text_perms(channels[2], bravo),
-            set_voice_perms(channels[3], alpha),
-            set_voice_perms(channels[4], bravo),
-        )
+        category, channels = await self.bot.match_pool.acquire(guild, f"match #{game_data['id']}", reason, match_overwrites(alpha, bravo))
 
         # send messages
         embed = discord.Embed(
@@ -220,33 +225,36 @@ class Matchmaker(commands.Cog):
         )
         components = spread_to_rows(match_issue)
 
-        msg1 = await channels[0].send(content=content[:-1], embed=embed, components=components)
+        route = f"channel:{channels[0].id}"
+        msg1 = await self.bot.scheduler.run(CRITICAL, route, lambda: channels[0].send(content=content[:-1], embed=embed, components=components))
 
         # send additional message for map generation
         button = create_button(
             style=ButtonStyle.green,
-            label="Generate Maps",
+            label="Reveal Maps",
             custom_id=f"generate_maps_{game_data['id']}",
         )
         components = spread_to_rows(button)
 
         embed = discord.Embed(
             colour=discord.Color.blue(),
-            title=f"Maps are not generated.",
+            title=f"Maps are hidden.",
             description="Click the button below to reveal the maps.",
             timestamp=datetime.utcnow()
         )
 
-        msg2 = await channels[0].send(embed=embed, components=components)
+        msg2 = await self.bot.scheduler.run(CRITICAL, route, lambda: channels[0].send(embed=embed, components=components))
 
         # pin messages
-        asyncio.create_task(msg2.pin())
-        asyncio.create_task(msg1.pin())
+        self.bot.scheduler.submit(LOW, f"pins:{channels[0].id}", msg2.pin)
+        self.bot.scheduler.submit(LOW, f"pins:{channels[0].id}", msg1.pin)
 
         # mark all players as last played on this date
         now = pytz.utc.localize(datetime.utcnow())
-        for player in players:
-            await self.bot.pg_con.execute("UPDATE users SET last_played = $2 WHERE user_id = $1", player.id, now)
+        await self.bot.pg_con.execute(
+            "UPDATE users SET last_played = $2 WHERE user_id = ANY ($1::bigint[])",
+            [player.id for player in players], now
+        )
         
         # move players to vc
         async def try_move(player, channel):
@@ -255,99 +263,151 @@ class Matchmaker(commands.Cog):
             except HTTPException:
                 pass
         
+        route = f"members:{guild.id}"
         for player in alpha:
-                asyncio.create_task(try_move(player, channels[3]))
+                self.bot.scheduler.submit(NORMAL, route, lambda player=player: try_move(player, channels[3]))
         for player in bravo:
-                asyncio.create_task(try_move(player, channels[4]))
+                self.bot.scheduler.submit(NORMAL, route, lambda player=player: try_move(player, channels[4]))
 
 
-    # Alpha are the first 4 players, Bravo are the last 4
+    # Alpha are the first 4 players, Bravo are the last 4, unless balance is set
     # can include only 2 players for testing
-    async def create_match(self, players: list[discord.User], mode: str, host: discord.User):
+    async def create_match(self, players: list[discord.User], mode: str, host: discord.User, parties=(), balance=False):
+        queue_engine = self.bot.queue_engine
+        player_ids = [player.id for player in players]
         try:
             # get name and thumbnail of the mode to send to players
-            mode_data = await self.bot.pg_con.fetchrow(
-                "SELECT * FROM modes WHERE internal_name = $1",
-                mode
+            mode_data = self.bot.mode_registry.get(mode)
+            await self.bot.pg_con.execute(
+                "UPDATE users SET queue_disable_time = $2 WHERE user_id = ANY ($1::bigint[])",
+                player_ids, pytz.utc.localize(datetime.utcnow())+relativedelta(seconds=+25)
             )
-            coroutines = []
-            for player in players:
-                await self.bot.pg_con.execute(
-                    "UPDATE users SET queue_disable_time = $2 WHERE user_id = $1",
-                    player.id, pytz.utc.localize(datetime.utcnow())+relativedelta(seconds=+25)
-                )
-                await self.bot.pg_con.execute(
-                    "UPDATE queue SET available = false WHERE $1 = ANY (player_ids::bigint[]) AND available = true",
-                    player.id
-                )
-                coroutines.append(
-                    self.send_ready_message(player, mode_data)
-                )
+            await queue_engine.reserve(self.bot.pg_con, player_ids)
 
-            players_ready = await asyncio.gather(*coroutines) # send ready message to all players and wait for all responces
+            players_ready = await self.ready_check(players, mode_data) # None for players who were still deciding when someone failed
 
-            coroutines = []
             if False in players_ready:
+                removed_ids = []
+                requeued_ids = []
                 for i in range(len(players_ready)):
-                    if not players_ready[i]:
-                        coroutines.append(
-                            self.send_info_message(players[i], "You did not accept the match and have been removed from the queue!"), #TODO: send different messages for groups
-                        )
-                        await self.bot.pg_con.execute(
-                                "DELETE FROM queue WHERE $1 = ANY (player_ids::bigint[])",
-                                players[i].id
-                            )
+                    if players_ready[i] is False:
+                        removed_ids.append(players[i].id)
                     else:
-                        coroutines.append(
-                            self.send_info_message(players[i], "A player did not accept the match."), #TODO: send different messages for groups
-                        )
-                        await self.bot.pg_con.execute(
-                                "UPDATE queue SET available = true WHERE $1 = ANY (player_ids::bigint[])",
-                                players[i].id
-                        )
-                await asyncio.gather(*coroutines)
+                        requeued_ids.append(players[i].id)
+                await queue_engine.dequeue(self.bot.pg_con, removed_ids)
+                await queue_engine.release(self.bot.pg_con, requeued_ids)
+
+                for i in range(len(players_ready)):
+                    if players_ready[i] is False:
+                        self.send_info_message(players[i], "You did not accept the match and have been removed from the queue!") #TODO: send different messages for groups
+                    else:
+                        self.send_info_message(players[i], "A player did not accept the match.") #TODO: send different messages for groups
                 return False
             else:
+                await queue_engine.dequeue(self.bot.pg_con, player_ids)
                 for player in players:
-                    coroutines.append(
-                        self.send_info_message(player, "All players accepted. Creating the match."),
-                    )
-                    await self.bot.pg_con.execute(
-                                "DELETE FROM queue WHERE $1 = ANY (player_ids::bigint[])",
-                                player.id
-                        )
-                await asyncio.gather(*coroutines)
-
-                await self.initialize_match(players, mode_data, host)
+                    self.send_info_message(player, "All players accepted. Creating the match.")
+
+                await self.initialize_match(players, mode_data, host, parties, balance)
                 return True
 
         except Exception as error:
             logging.exception("Create match error!", exc_info=error)
+            # put back whoever is still queued, a resync would keep them reserved
+            try:
+                await queue_engine.release(self.bot.pg_con, player_ids)
+            except Exception as error:
+                logging.exception("Release reserved players error!", exc_info=error)
+            self.next_queue_sync = datetime.utcnow() # the queue table is the source of truth, resync from it
             return
 
 
+    async def start_match(self, groups, mode):
+        guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
+        player_ids = []
+        for group in groups:
+            player_ids += group.player_ids
+
+        # drop groups with players that left the server
+        players = []
+        missing_ids = []
+        for player_id in player_ids:
+            member = guild.get_member(player_id)
+            if member:
+                players.append(member)
+            else:
+                missing_ids.append(player_id)
+
+        if missing_ids:
+            await self.bot.queue_engine.dequeue(self.bot.pg_con, missing_ids)
+            self.bot.queue_engine.set_available(player_ids, True)
+            return
+
+        # pick the player with the best host preference as the host
+        users = await self.bot.pg_con.fetch(
+            "SELECT user_id, host_pref, friend_code FROM users WHERE user_id = ANY ($1::bigint[])",
+            player_ids
+        )
+        host_id = player_ids[0]
+        best_pref = -1
+        for user in users:
+            pref = user['host_pref'] if user['friend_code'] else 0
+            if pref > best_pref:
+                host_id = user['user_id']
+                best_pref = pref
+        host = guild.get_member(host_id)
+
+        await self.create_match(players, mode, host, [group.player_ids for group in groups], balance=True)
+
+
     @tasks.loop(seconds=1)
     async def matchmaker(self):
-        return
-        guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
+        if datetime.utcnow() > self.next_queue_sync:
+            await self.bot.queue_engine.sync(self.bot.pg_con)
+            self.next_queue_sync = datetime.utcnow()+relativedelta(seconds=QUEUE_SYNC_SECONDS)
+
+        self.match_queued_groups()
+
 
-        if datetime.utcnow() > self.next_mode_cache:
-            modes = await self.bot.pg_con.fetch("SELECT internal_name FROM modes WHERE status = 1")
-            self.modes_cache = []
-            for mode in modes:
-                self.modes_cache.append(mode['internal_name'])
-            self.next_mode_cache = datetime.utcnow()+relativedelta(seconds=MODE_CACHE_SECONDS)
+    def match_queued_groups(self):
+        now = pytz.utc.localize(datetime.utcnow())
+        for mode in self.bot.mode_registry.with_status(1):
+            curve = SearchCurve(mode['search_range'], mode['search_range_growth'], mode['search_range_max'])
+            for groups in self.bot.queue_engine.pop_matches(mode['internal_name'], now, curve):
+                asyncio.create_task(self.start_match(groups, mode['internal_name']))
+
+
+    async def on_queue_event(self, event):
+        # the cogs already mirror their own writes, this catches writes from anywhere else
+        queue_engine = self.bot.queue_engine
+        player_ids = event['player_ids']
+        group = queue_engine.get(player_ids[0])
+        if event['op'] == 'DELETE':
+            # a late delete must not remove a group that has rejoined since
+            if group and abs(group.join_date.timestamp() - event['join_date']) < 0.001:
+                queue_engine.remove(player_ids[0])
+        elif not group:
+            join_date = datetime.fromtimestamp(event['join_date'], pytz.utc)
+            await queue_engine.load_group(self.bot.pg_con, player_ids, event['modes'], join_date)
+            queue_engine.set_available(player_ids, event['available'])
+
+        if event['op'] == 'INSERT':
+            self.match_queued_groups()
 
-        all_groups = await self.bot.pg_con.fetch("SELECT * FROM queue")
-        for mode in self.modes_cache:
-            pass # TODO: finish the matchmaker here
+
+    async def on_event_bus_reconnect(self):
+        self.next_queue_sync = datetime.utcnow() # queue events may have been missed, resync on the next loop
+
+
+    async def on_modes_event(self, event):
+        self.match_queued_groups() # a mode may have opened
 
 
     @matchmaker.before_loop
     async def before_matchmaker(self):
         await self.bot.wait_until_ready()
-        self.modes_cache = []
-        self.next_mode_cache = datetime.utcnow()
+        guild = discord.utils.get(self.bot.guilds, id=bot_data['guild_id'])
+        self.bot.match_pool.replenish(guild)
         logging.info("Starting matchmaker")
     
 
@@ -431,7 +491,7 @@ class Matchmaker(commands.Cog):
                     return
         
         # mode select
-        modes = await self.bot.pg_con.fetch("SELECT name, internal_name FROM modes ORDER BY sort_order ASC")
+        modes = self.bot.mode_registry.all()
 
         options = []
         for mode in modes:
@@ -484,7 +544,7 @@ class Matchmaker(commands.Cog):
         
         while True:
             try:
-                component_ctx = await wait_for_component(self.bot, messages=msg, timeout=60.0)
+                component_ctx = await self.bot.router.wait_for_component(msg, timeout=60.0)
             except asyncio.TimeoutError:
                 await msg.edit(content="Took too long! Please try again.", components=None)
                 return
@@ -549,7 +609,7 @@ class Matchmaker(commands.Cog):
                     return
         
         # mode select
-        modes = await self.bot.pg_con.fetch("SELECT name, internal_name FROM modes ORDER BY sort_order ASC")
+        modes = self.bot.mode_registry.all()
 
         options = []
         for mode in modes:
@@ -602,7 +662,7 @@ class Matchmaker(commands.Cog):
         
         while True:
             try:
-                component_ctx = await wait_for_component(self.bot, messages=msg, timeout=60.0)
+                component_ctx = await self.bot.router.wait_for_component(msg, timeout=60.0)
             except asyncio.TimeoutError:
                 await msg.edit(content="Took too long! Please try again.", components=None)
                 return
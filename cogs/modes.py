@@ -6,9 +6,13 @@ from discord_slash.utils.manage_commands import create_option, SlashCommandOptio
 from discord_slash.utils.manage_components import ButtonStyle, create_button, create_select_option, spread_to_rows, create_select
 
 from datetime import datetime
-import json, logging, asyncio, pytz
+import json, logging, asyncio, pytz, hashlib
+
+from request_scheduler import LOW
 
 ICON_URL = "https://i.imgur.com/YmTNuR5.png"
+BOARD_REFRESH_SECONDS = 60 # the board is refreshed on queue, game and mode events, this is only a safety net
+BOARD_DEBOUNCE_SECONDS = 0.5 # wait for bursts of events to settle before refreshing
 with open("bot.json", "r") as f:
     bot_data = json.load(f)
 
@@ -17,10 +21,21 @@ class Modes(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.board_lock = asyncio.Lock()
+        self.board_refresh = None
+        self.board_dirty = False
+        self.board_messages = None # newest first, like channel.history
+        self.board_hashes = {} # message id -> hash of the last content sent
         self.update_modes.start()
+        for table in ('queue', 'games'):
+            self.bot.event_bus.subscribe(table, self.on_board_event)
+        self.bot.mode_registry.subscribe(self.on_board_event) # after the registry has the new modes
 
     def cog_unload(self):
         self.update_modes.cancel()
+        for table in ('queue', 'games'):
+            self.bot.event_bus.unsubscribe(table, self.on_board_event)
+        self.bot.mode_registry.unsubscribe(self.on_board_event)
 
 
     def list_modes(self, internal_names, modes):
@@ -51,16 +66,65 @@ class Modes(commands.Cog):
         return f"{minutes}:{seconds}"
 
 
-    @tasks.loop(seconds=15.0)
+    async def on_board_event(self, event):
+        if not self.update_modes.is_running():
+            return
+        self.board_dirty = True
+        if not self.board_refresh or self.board_refresh.done():
+            self.board_refresh = asyncio.create_task(self.refresh_board())
+
+
+    async def refresh_board(self):
+        while self.board_dirty:
+            await asyncio.sleep(BOARD_DEBOUNCE_SECONDS)
+            self.board_dirty = False
+            try:
+                async with self.board_lock:
+                    await self.render_board()
+            except Exception as error:
+                logging.exception("Mode Updater error!", exc_info=error)
+
+
+    @tasks.loop(seconds=BOARD_REFRESH_SECONDS)
     async def update_modes(self):
+        async with self.board_lock:
+            # correct any drift from missed events
+            await self.bot.mode_registry.refresh()
+            await self.bot.mode_counters.refresh(self.bot.pg_con)
+            await self.render_board()
+
+
+    async def edit_board_message(self, message, embed, components):
+        # only edit messages whose content actually changed
+        content_hash = hashlib.sha1(
+            json.dumps({'embed': embed.to_dict(), 'components': components}, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        if self.board_hashes.get(message.id) == content_hash:
+            return
+
+        # set before the edit runs, a newer edit may replace this one while it waits
+        self.board_hashes[message.id] = content_hash
+        try:
+            await self.bot.scheduler.run(
+                LOW, f"channel:{message.channel.id}", lambda: message.edit(content=None, embed=embed, components=components), key=f"edit:{message.id}"
+            )
+        except discord.NotFound:
+            self.board_messages = None # someone deleted a board message, rebuild from the channel next time
+            self.board_hashes.clear()
+        except Exception:
+            if self.board_hashes.get(message.id) == content_hash:
+                del self.board_hashes[message.id]
+            raise
+
+
+    async def render_board(self):
         channel = discord.utils.get(self.bot.get_all_channels(), guild__id=bot_data['guild_id'], name='modes')
 
-        gather = await asyncio.gather(
-            channel.history(limit=100).flatten(),
-            self.bot.pg_con.fetch("SELECT * FROM modes ORDER BY sort_order ASC")
-        )
-        messages = gather[0]
-        modes = gather[1]
+        modes = self.bot.mode_registry.all()
+        if self.board_messages is None:
+            self.board_messages = await channel.history(limit=100).flatten()
+            self.board_hashes.clear()
+        messages = self.board_messages
         
         visible_modes = 0
         for mode in modes:
@@ -78,6 +142,7 @@ class Modes(commands.Cog):
             for i in range(change):
                 index = len(messages) - 1
                 await messages[index].delete()
+                self.board_hashes.pop(messages[index].id, None)
                 del messages[index]
 
         options = []
@@ -107,30 +172,17 @@ class Modes(commands.Cog):
             embed.add_field(name="Status", value=f"`{status}`") # TODO: made this inline false when more information is given
 
             if mode['status'] in (1, 2):
-                queue = await self.bot.pg_con.fetch(
-                    "SELECT * FROM queue WHERE $1 = ANY (modes::varchar[])",
-                    mode['internal_name']
-                )
-                search_count = len(queue)
+                search_count, play_count = self.bot.mode_counters.get(mode['internal_name'])
                 embed.add_field(
                     name="Searching",
                     value=f"`{search_count}` 🔎"
                 )
-
-                games = await self.bot.pg_con.fetch(
-                    "SELECT * FROM games WHERE mode = $1 AND game_active = true",
-                    mode['internal_name']
-                )
-                play_count = 0
-                for game in games:
-                    play_count += len(game['alpha_players'])
-                    play_count += len(game['bravo_players'])
                 embed.add_field(
                     name="In-game",
                     value=f"`{play_count}` 🆚"
                 )
 
-            asyncio.create_task(messages[i].edit(content=None, embed=embed, components=None))
+            asyncio.create_task(self.edit_board_message(messages[i], embed, None))
 
             if mode['status'] == 1:
                 emoji = self.bot.get_emoji(mode['emoji_id']) if mode['emoji_id'] else None
@@ -180,7 +232,7 @@ class Modes(commands.Cog):
             ),
         )
 
-        await messages[0].edit(content=None, embed=embed, components=components)
+        await self.edit_board_message(messages[0], embed, components)
 
 
     @update_modes.before_loop
@@ -197,7 +249,7 @@ class Modes(commands.Cog):
     @cog_ext.cog_component()
     async def join_queue(self, ctx: ComponentContext):
         try:
-            modes = await self.bot.pg_con.fetch("SELECT name, internal_name, status, emoji_id FROM modes WHERE internal_name = ANY ($1::varchar[])", ctx.selected_options)
+            modes = self.bot.mode_registry.get_many(ctx.selected_options)
 
             for mode in modes:
                 if mode['status'] == 2:
@@ -212,7 +264,7 @@ class Modes(commands.Cog):
 
             # prevent players from joining if they are already in a game
             game = await self.bot.pg_con.fetchrow(
-                "SELECT game_active, alpha_players, bravo_players FROM games WHERE game_active = true AND ($1 = ANY (alpha_players::bigint[]) OR $1 = ANY (bravo_players::bigint[]))",
+                "SELECT id FROM games WHERE game_active AND (alpha_players || bravo_players) @> ARRAY[$1::bigint]",
                 ctx.author_id
             )
             if game:
@@ -235,7 +287,7 @@ class Modes(commands.Cog):
                     )
 
             queue = await self.bot.pg_con.fetchrow(
-                "SELECT * FROM queue WHERE $1 = ANY (player_ids::bigint[])",
+                "SELECT * FROM queue WHERE player_ids @> ARRAY[$1::bigint]",
                 ctx.author_id
             )
             if queue:
@@ -253,10 +305,12 @@ class Modes(commands.Cog):
             #         ctx.author_id, internal_name, 1500.0, 350.0, 0.06
             #     )
 
+            join_date = pytz.utc.localize(datetime.utcnow())
             await self.bot.pg_con.execute(
                 "INSERT INTO queue (modes, player_count, player_ids, join_date) VALUES ($1, $2, $3, $4)",
-                ctx.selected_options, 1, [ctx.author_id], pytz.utc.localize(datetime.utcnow())
+                ctx.selected_options, 1, [ctx.author_id], join_date
             )
+            await self.bot.queue_engine.load_group(self.bot.pg_con, [ctx.author_id], ctx.selected_options, join_date)
 
         except Exception as error:
             logging.exception("Join queue error!", exc_info=error)
@@ -268,13 +322,13 @@ class Modes(commands.Cog):
     @cog_ext.cog_component()
     async def show_queue(self, ctx: ComponentContext):
         queue = await self.bot.pg_con.fetchrow(
-            "SELECT modes, player_ids, join_date FROM queue WHERE $1 = ANY (player_ids::bigint[])",
+            "SELECT modes, player_ids, join_date FROM queue WHERE player_ids @> ARRAY[$1::bigint]",
             ctx.author_id
         )
         if not queue:
             await ctx.send(f"You are not in the queue.", hidden=True)
         else:
-            modes = await self.bot.pg_con.fetch("SELECT internal_name, name, emoji_id FROM modes WHERE internal_name = ANY ($1::varchar[]);", queue['modes'])
+            modes = self.bot.mode_registry.get_many(queue['modes'])
             content = f"You are currently in queue for: **{self.list_modes(queue['modes'], modes)}**\nElapsed time: `{self.elapsed_time(queue['join_date'])}`"
             await ctx.send(content=content, hidden=True)
     
@@ -282,10 +336,11 @@ class Modes(commands.Cog):
     @cog_ext.cog_component()
     async def leave_queue(self, ctx: ComponentContext):
         result = await self.bot.pg_con.fetchrow( # TODO: only allow the party leader to leave
-            "DELETE FROM queue WHERE $1 = ANY (player_ids::bigint[]) RETURNING *",
+            "DELETE FROM queue WHERE player_ids @> ARRAY[$1::bigint] RETURNING *",
             ctx.author_id
         )
         if result:
+            self.bot.queue_engine.remove(ctx.author_id)
             await ctx.send(f"You left the queue!\nElapsed time: `{self.elapsed_time(result['join_date'])}`", hidden=True)
         else:
             await ctx.send(f"You are not in the queue.", hidden=True)
@@ -5,7 +5,7 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import json, logging, asyncio, pytz
 
-from glicko2 import Player
+from rating_batch import rollover
 
 with open("bot.json", "r") as f:
     bot_data = json.load(f)
@@ -34,31 +34,45 @@ class Rating(commands.Cog):
                 logging.warning(f"Automatically set the last_rating_period of mode \"{mode['internal_name']}\" to \"{date}\". It is recommended to change this date so the rating period is changed on the hour or on the day.")
                 continue
             
-            for i in range(30): # this is a loop so missed days can be advanced quickly, limit to 30 so it doesn't infinite loop
-                next_rating_period = mode['last_rating_period']+relativedelta(hours=mode['rating_period_hours'])
-                if now >= next_rating_period:
-                    logging.info(f"Advancing rating period for mode \"{mode['internal_name']}\".")
-                    players = await self.bot.pg_con.fetch( # get all players who did not play in the period
-                        "SELECT * FROM ratings WHERE mode = $1 AND (rating_list = '{}' OR deviation_list = '{}' or outcome_list = '{}')",
+            # count the missed periods so they can all be advanced at once, limit to 30 so it doesn't infinite loop
+            periods = 0
+            last_rating_period = mode['last_rating_period']
+            for i in range(30):
+                next_rating_period = last_rating_period+relativedelta(hours=mode['rating_period_hours'])
+                if now < next_rating_period:
+                    break
+                last_rating_period = next_rating_period
+                periods += 1
+
+            if periods == 0:
+                continue
+
+            logging.info(f"Advancing {periods} rating period(s) for mode \"{mode['internal_name']}\".")
+            async with self.bot.pg_con.acquire() as con:
+                async with con.transaction():
+                    players = await con.fetch(
+                        "SELECT user_id, rating, deviation, volatility, variance_sum FROM ratings WHERE mode = $1 FOR UPDATE",
                         mode['internal_name']
                     )
-                    for player in players:
-                        glicko_player = Player(rating=player['rating'], rd=player['deviation'], vol=player['volatility'])
-                        glicko_player.did_not_compete()
-                        rd = min(glicko_player.rd, 350)
-                        await self.bot.pg_con.execute(
-                            "UPDATE ratings SET rating = $3, deviation = $4, volatility = $5 WHERE user_id = $1 AND mode = $2",
-                            player['user_id'], player['mode'], glicko_player.rating, rd, glicko_player.vol
+                    if players:
+                        ratings, deviations, volatilities = rollover(
+                            [player['rating'] for player in players],
+                            [player['deviation'] for player in players],
+                            [player['volatility'] for player in players],
+                            [player['variance_sum'] for player in players],
+                            periods
                         )
-                    await self.bot.pg_con.execute(
-                        "UPDATE ratings SET rating_list = '{}', deviation_list = '{}', outcome_list = '{}', rating_initial = rating, deviation_initial = deviation, volatility_initial = volatility"
-                    )
-                    mode = await self.bot.pg_con.fetchrow(
-                        "UPDATE modes SET last_rating_period = $2 WHERE internal_name = $1 RETURNING internal_name, last_rating_period, rating_period_hours",
-                        mode['internal_name'], next_rating_period
+                        await con.execute( # the period's games are already in rating, so start the next period from it
+                            """UPDATE ratings SET rating = new.rating, deviation = new.deviation, volatility = new.volatility,
+                            rating_initial = new.rating, deviation_initial = new.deviation, volatility_initial = new.volatility, variance_sum = 0, improvement_sum = 0
+                            FROM unnest($2::bigint[], $3::float8[], $4::float8[], $5::float8[]) AS new (user_id, rating, deviation, volatility)
+                            WHERE ratings.mode = $1 AND ratings.user_id = new.user_id""",
+                            mode['internal_name'], [player['user_id'] for player in players], ratings.tolist(), deviations.tolist(), volatilities.tolist()
+                        )
+                    await con.execute(
+                        "UPDATE modes SET last_rating_period = $2 WHERE internal_name = $1",
+                        mode['internal_name'], last_rating_period
                     )
-                else:
-                    break
 
 
     @manage_rating_periods.before_loop
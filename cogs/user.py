@@ -2,7 +2,7 @@ import discord
 from discord.ext import commands
 from discord_slash import cog_ext, SlashContext, ComponentContext
 from discord_slash.utils.manage_commands import create_option, SlashCommandOptionType, create_permission
-from discord_slash.utils.manage_components import ButtonStyle, spread_to_rows, create_button, wait_for_component
+from discord_slash.utils.manage_components import ButtonStyle, spread_to_rows, create_button
 from discord_slash.model import SlashCommandPermissionType
 
 from datetime import datetime
@@ -76,7 +76,7 @@ class User(commands.Cog):
         msg = await channel.send(embed=embed, components=components)
         
         try:
-            button_ctx = await wait_for_component(self.bot, messages=msg, timeout=90)
+            button_ctx = await self.bot.router.wait_for_component(msg, timeout=90)
         except asyncio.TimeoutError:
             await timeout()
             return
@@ -107,7 +107,7 @@ class User(commands.Cog):
         await button_ctx.edit_origin(embed=embed, components=components)
 
         try:
-            button_ctx = await wait_for_component(self.bot, messages=msg, timeout=90)
+            button_ctx = await self.bot.router.wait_for_component(msg, timeout=90)
         except asyncio.TimeoutError:
             await timeout()
             return
@@ -134,11 +134,8 @@ class User(commands.Cog):
 
                 await msg.edit(embed=embed, components=None)
 
-                def check(msg):
-                    return msg.channel == channel
-
                 try:
-                    reply = await self.bot.wait_for('message', timeout=90, check=check)
+                    reply = await self.bot.router.wait_for_message(channel, timeout=90)
                 except asyncio.TimeoutError:
                     await timeout()
                     return
@@ -220,14 +217,10 @@ class User(commands.Cog):
             value = "None"
         else:
             value = ""
-            modes = await self.bot.pg_con.fetch(
-                "SELECT internal_name, name FROM modes",
-            )  
             for rating in rating_data:
-                for mode in modes:
-                    if mode['internal_name'] == rating['mode']:
-                        value += f"\n{mode['name']} - `{'{:.1f}'.format(rating['rating'])}`"
-                        break
+                mode = self.bot.mode_registry.get(rating['mode'])
+                if mode:
+                    value += f"\n{mode['name']} - `{'{:.1f}'.format(rating['rating'])}`"
         
         embed.add_field(name="Ratings", value=value, inline=False)
 
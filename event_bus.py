@@ -0,0 +1,84 @@
+import asyncpg
+
+import json, logging, asyncio
+
+CHANNEL = "beam_net_events" # the triggers that notify it are made by a migration, see migrations.py
+RECONNECT_SECONDS = 30
+
+
+class EventBus:
+    """Dispatches table change notifications to the cogs.
+
+    Handlers are coroutine functions subscribed per table and called with
+    the decoded event. Notifications sent while the listener is reconnecting
+    are lost, so anything kept in memory should resync in a reconnect handler,
+    a coroutine function called with no arguments once the listener is back.
+    Cogs should also keep a slow polling loop as a safety net.
+    """
+
+    def __init__(self):
+        self.handlers = {} # table -> list of handlers
+        self.reconnect_handlers = []
+        self.connection = None
+        self.connect_kwargs = None
+
+    def subscribe(self, table, handler):
+        self.handlers.setdefault(table, []).append(handler)
+
+    def unsubscribe(self, table, handler):
+        handlers = self.handlers.get(table, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def subscribe_reconnect(self, handler):
+        self.reconnect_handlers.append(handler)
+
+    def unsubscribe_reconnect(self, handler):
+        if handler in self.reconnect_handlers:
+            self.reconnect_handlers.remove(handler)
+
+    async def connect(self, **kwargs):
+        # LISTEN needs its own connection that is never returned to the pool
+        self.connect_kwargs = kwargs
+        self.connection = await asyncpg.connect(**kwargs)
+        await self.connection.add_listener(CHANNEL, self.on_notification)
+        self.connection.add_termination_listener(self.on_termination)
+        logging.info("Event bus connected.")
+
+    def on_termination(self, connection):
+        logging.warning(f"Event bus connection lost. Reconnecting in {RECONNECT_SECONDS} seconds.")
+        asyncio.create_task(self.reconnect())
+
+    async def reconnect(self):
+        while True:
+            await asyncio.sleep(RECONNECT_SECONDS)
+            try:
+                await self.connect(**self.connect_kwargs)
+            except Exception as error:
+                logging.exception("Event bus reconnect error!", exc_info=error)
+            else:
+                for handler in list(self.reconnect_handlers):
+                    asyncio.create_task(self.dispatch_reconnect(handler))
+                return
+
+    def on_notification(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logging.warning(f"Event bus received an invalid payload: {payload}")
+            return
+
+        for handler in list(self.handlers.get(event.get('table'), [])):
+            asyncio.create_task(self.dispatch(handler, event))
+
+    async def dispatch(self, handler, event):
+        try:
+            await handler(event)
+        except Exception as error:
+            logging.exception("Event handler error!", exc_info=error)
+
+    async def dispatch_reconnect(self, handler):
+        try:
+            await handler()
+        except Exception as error:
+            logging.exception("Event bus reconnect handler error!", exc_info=error)
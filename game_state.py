@@ -0,0 +1,107 @@
+class GameState:
+    """The parts of an active game needed to handle its buttons.
+
+    Supports game['column'] like the asyncpg records it replaces.
+    """
+    __slots__ = (
+        "id", "mode", "host", "alpha_players", "bravo_players", "score", "game_maps", "game_modes",
+        "admin_locked", "submit_time", "game_active", "play_all_games", "score_version",
+    )
+
+    def __init__(self, record):
+        for name in self.__slots__:
+            value = record[name]
+            setattr(self, name, list(value) if isinstance(value, list) else value)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class GameStateStore:
+    """Active games held in memory and written through to the games table.
+
+    Every change to a cached game must go through update so the cache and
+    the table agree. Games are dropped when they close or are deleted.
+    """
+
+    def __init__(self):
+        self.games = {} # id -> GameState
+
+    async def get(self, pg_con, id):
+        game = self.games.get(id)
+        if game:
+            return game
+
+        record = await pg_con.fetchrow(
+            """SELECT games.id, games.mode, host, alpha_players, bravo_players, score, game_maps, game_modes, admin_locked, submit_time, game_active, modes.play_all_games, score_version
+            FROM games JOIN modes ON modes.internal_name = games.mode WHERE games.id = $1""",
+            id
+        )
+        if not record:
+            return None
+        game = GameState(record)
+        if game.game_active:
+            self.games[id] = game
+        return game
+
+    async def update(self, pg_con, id, **changes):
+        # changes are column names and their new values
+        columns = list(changes)
+        assignments = ", ".join(f"{column} = ${i + 2}" for i, column in enumerate(columns))
+        await pg_con.execute(f"UPDATE games SET {assignments} WHERE id = $1", id, *changes.values())
+
+        game = self.games.get(id)
+        if game:
+            for column, value in changes.items():
+                if column in GameState.__slots__:
+                    setattr(game, column, value)
+
+    async def change_score(self, pg_con, id, score_id, version):
+        """Report the next game for a team (score_id 1 or 2) or undo the last report (score_id 0).
+
+        The change is applied in a single statement and only if the score is
+        still at version, so concurrent clicks can't overwrite each other.
+        Returns the new score and version, or None if the change was rejected.
+        """
+        if score_id == 0:
+            record = await pg_con.fetchrow(
+                """UPDATE games SET score[coalesce(array_position(score, 0), cardinality(score) + 1) - 1] = 0, score_version = score_version + 1
+                WHERE id = $1 AND score_version = $2 AND score[1] <> 0 RETURNING score, score_version""",
+                id, version
+            )
+        else:
+            record = await pg_con.fetchrow(
+                """UPDATE games SET score[array_position(score, 0)] = $2, score_version = score_version + 1
+                WHERE id = $1 AND score_version = $3 AND 0 = ANY (score) RETURNING score, score_version""",
+                id, score_id, version
+            )
+
+        if not record:
+            self.invalidate(id) # the cached score is out of date
+            return None
+
+        game = self.games.get(id)
+        if game:
+            game.score = list(record['score'])
+            game.score_version = record['score_version']
+        return record
+
+    def invalidate(self, id):
+        self.games.pop(id, None)
+
+    async def on_games_event(self, event):
+        # keep up with changes made outside of update
+        game = self.games.get(event['id'])
+        if not game:
+            return
+        if event['op'] == 'DELETE' or not event['game_active']:
+            self.invalidate(event['id'])
+            return
+
+        submit_time = game.submit_time.timestamp() if game.submit_time else None
+        if submit_time is None or event['submit_time'] is None:
+            changed = submit_time != event['submit_time']
+        else:
+            changed = abs(submit_time - event['submit_time']) > 0.001
+        if changed:
+            self.invalidate(event['id'])
@@ -0,0 +1,47 @@
+import asyncio
+
+
+class InteractionRouter:
+    """Hands component and message events to whoever is waiting on them.
+
+    Replaces wait_for_component and bot.wait_for, which test every event
+    against every waiting check. Waiters are kept in dicts keyed by message
+    id (components) or channel id (messages) so each event is one lookup.
+    There is one waiter per key, a new one replaces the old.
+    """
+
+    def __init__(self):
+        self.components = {} # message id -> future
+        self.messages = {} # channel id -> future
+
+    async def _wait(self, waiters, key, timeout):
+        future = asyncio.get_running_loop().create_future()
+        old_future = waiters.get(key)
+        if old_future and not old_future.done():
+            old_future.cancel()
+        waiters[key] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if waiters.get(key) is future:
+                del waiters[key]
+
+    async def wait_for_component(self, message, timeout):
+        """Returns the ComponentContext of the next use of a component on message."""
+        return await self._wait(self.components, message.id, timeout)
+
+    async def wait_for_message(self, channel, timeout):
+        return await self._wait(self.messages, channel.id, timeout)
+
+    def _resolve(self, waiters, key, value):
+        future = waiters.pop(key, None)
+        if future and not future.done():
+            future.set_result(value)
+
+    async def on_component(self, ctx):
+        self._resolve(self.components, ctx.origin_message_id, ctx)
+
+    async def on_message(self, message):
+        if message.author.bot:
+            return
+        self._resolve(self.messages, message.channel.id, message)
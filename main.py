@@ -4,6 +4,16 @@ from discord_slash import SlashCommand
 
 import logging, os, asyncpg, json
 
+from queue_engine import QueueEngine
+from event_bus import EventBus
+from mode_counters import ModeCounters
+from maplist_utils import MaplistRegistry
+from match_pool import MatchPool
+from request_scheduler import RequestScheduler
+from interaction_router import InteractionRouter
+from migrations import migrate
+from mode_registry import ModeRegistry
+
 
 DB_PORT = '5432'
 
@@ -35,9 +45,28 @@ bot = commands.Bot(
     intents=intents,
 )
 slash = SlashCommand(bot, sync_commands=False, sync_on_cog_reload=False)
+bot.queue_engine = QueueEngine() # lives on the bot so it survives cog reloads
+bot.event_bus = EventBus()
+bot.maplists = MaplistRegistry()
+bot.match_pool = MatchPool()
+bot.scheduler = RequestScheduler()
+bot.router = InteractionRouter()
+bot.add_listener(bot.router.on_component, 'on_component')
+bot.add_listener(bot.router.on_message, 'on_message')
+bot.mode_counters = ModeCounters()
+bot.mode_registry = ModeRegistry()
+bot.event_bus.subscribe('modes', bot.mode_registry.on_modes_event)
+bot.event_bus.subscribe_reconnect(bot.mode_registry.on_reconnect)
+bot.event_bus.subscribe('queue', bot.mode_counters.on_queue_event)
+bot.event_bus.subscribe('games', bot.mode_counters.on_games_event)
 
 async def create_db_pool():
-    bot.pg_con = await asyncpg.create_pool(host=bot_data['address'], port=DB_PORT, database=bot_data['name'], user='postgres', password=bot_data['pass'])
+    db_kwargs = dict(host=bot_data['address'], port=DB_PORT, database=bot_data['name'], user='postgres', password=bot_data['pass'])
+    bot.pg_con = await asyncpg.create_pool(**db_kwargs)
+    await migrate(bot.pg_con)
+    await bot.queue_engine.release_all(bot.pg_con)
+    await bot.mode_registry.load(bot.pg_con)
+    await bot.event_bus.connect(**db_kwargs)
 
 @bot.event
 async def on_ready():
@@ -91,6 +120,14 @@ async def load(ctx: commands.Context, cog):
     bot.reload_extension(f"cogs.{cog}")
     await ctx.send(f"Successfully reloaded {cog}. If any commands have been updated, make sure to use the `sync` command!")
 
+@bot.command(
+    name = "modes",
+)
+@commands.has_permissions(administrator=True)
+async def modes(ctx: commands.Context):
+    await bot.mode_registry.on_modes_event({'table': 'modes', 'op': 'REFRESH', 'internal_name': None})
+    await ctx.send(f"Successfully reloaded {len(bot.mode_registry.all())} modes.")
+
 @bot.command(
     name="sync"
 )
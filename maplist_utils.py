@@ -0,0 +1,142 @@
+import json, logging, os, random, time
+
+MAPLIST_DIR = "./data/maplists"
+MAP_KEY_PATH = "./data/maps.json"
+MODE_KEY_PATH = "./data/modes.json"
+RELOAD_CHECK_SECONDS = 30 # how often maplist files are checked for changes
+MAPLIST_LUCK = 3 # the higher the number, the more good maps and the less bad maps
+
+
+class Maplist:
+    """A validated maplist with the weights of every map for each mode."""
+
+    def __init__(self, name, data, map_key, mode_key):
+        self.name = name
+        self.maps = list(data)
+        self.weights = {} # mode -> weight of each map, in the same order as maps
+
+        for map in self.maps:
+            if map not in map_key:
+                raise ValueError(f"Maplist \"{name}\" has unknown map \"{map}\".")
+            for mode, weight in data[map].items():
+                if mode not in mode_key:
+                    raise ValueError(f"Maplist \"{name}\" has unknown mode \"{mode}\" for map \"{map}\".")
+                if not isinstance(weight, int) or weight < 0:
+                    raise ValueError(f"Maplist \"{name}\" has an invalid weight for map \"{map}\" on mode \"{mode}\".")
+
+        for mode in mode_key:
+            self.weights[mode] = [data[map].get(mode, 0) for map in self.maps]
+
+
+class _WeightTree:
+    # fenwick tree over map weights so picking and removing a map are both O(log maps)
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        for i, weight in enumerate(weights):
+            self.add(i, weight)
+
+    def add(self, index, change):
+        self.total += change
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += change
+            i += i & -i
+
+    def find(self, target):
+        # index of the map that covers target in the cumulative weights
+        index = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_index = index + step
+            if next_index <= self.size and self.tree[next_index] <= target:
+                index = next_index
+                target -= self.tree[next_index]
+            step >>= 1
+        return index
+
+
+def generate_maps(maplist, modes, luck=MAPLIST_LUCK, rng=random):
+    """Pick a map for each mode in order without repeating maps.
+
+    Each map is weighted by its maplist weight raised to luck, the same odds
+    as putting weight ** luck copies of it in a pool.
+    """
+    trees = {}
+    for mode in modes:
+        if mode not in trees:
+            trees[mode] = _WeightTree([weight ** luck for weight in maplist.weights[mode]])
+
+    generated_maps = []
+    generated_modes = []
+    for mode in modes:
+        tree = trees[mode]
+        if tree.total <= 0:
+            raise ValueError(f"Maplist \"{maplist.name}\" has no maps left for mode \"{mode}\".")
+        index = tree.find(rng.randrange(tree.total))
+
+        # remove the map from every pool
+        for pool_mode, pool in trees.items():
+            weight = maplist.weights[pool_mode][index] ** luck
+            if weight:
+                pool.add(index, -weight)
+
+        generated_maps.append(maplist.maps[index])
+        generated_modes.append(mode)
+    return generated_maps, generated_modes
+
+
+def new_map_seed():
+    return random.SystemRandom().getrandbits(63) # fits in a bigint column
+
+
+def generate_seeded_maps(maplist, modes, seed, luck=MAPLIST_LUCK):
+    # the same seed, maplist and modes always give the same maps
+    return generate_maps(maplist, modes, luck, random.Random(seed))
+
+
+class MaplistRegistry:
+    """Loads maplists once and reloads them when their file changes."""
+
+    def __init__(self, directory=MAPLIST_DIR):
+        with open(MAP_KEY_PATH, "r") as f:
+            self.map_key = json.load(f)
+        with open(MODE_KEY_PATH, "r") as f:
+            self.mode_key = json.load(f)
+        self.directory = directory
+        self.maplists = {} # name -> (maplist, file modified time)
+        self.next_check = {} # name -> time of the next modified time check
+        self.load_all()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, name):
+        mtime = os.stat(self.path(name)).st_mtime
+        with open(self.path(name), "r") as f:
+            maplist = Maplist(name, json.load(f), self.map_key, self.mode_key)
+        self.maplists[name] = (maplist, mtime)
+        self.next_check[name] = time.monotonic() + RELOAD_CHECK_SECONDS
+        return maplist
+
+    def load_all(self):
+        for file in os.listdir(self.directory):
+            if file.endswith(".json"):
+                self.load(file[:-5])
+
+    def get(self, name):
+        if name not in self.maplists:
+            return self.load(name)
+
+        maplist, mtime = self.maplists[name]
+        if time.monotonic() >= self.next_check[name]:
+            self.next_check[name] = time.monotonic() + RELOAD_CHECK_SECONDS
+            if os.stat(self.path(name)).st_mtime != mtime:
+                try:
+                    return self.load(name)
+                except ValueError as error: # includes invalid json
+                    logging.error(f"Could not reload maplist \"{name}\", keeping the old one. {error}")
+                    self.maplists[name] = (maplist, os.stat(self.path(name)).st_mtime)
+        return maplist
@@ -0,0 +1,120 @@
+import discord
+
+import logging, asyncio
+
+POOL_SIZE = 3 # idle match categories kept ready
+POOL_CATEGORY_NAME = "match pool"
+TEMPLATE_CATEGORY_NAME = "match template"
+
+TEXT_OVERWRITE = discord.PermissionOverwrite(view_channel=True)
+VOICE_OVERWRITE = discord.PermissionOverwrite(view_channel=True, connect=True)
+
+
+def match_overwrites(alpha, bravo):
+    """Player overwrites for each match channel, in template order."""
+    return [
+        {player: TEXT_OVERWRITE for player in alpha + bravo},
+        {player: TEXT_OVERWRITE for player in alpha},
+        {player: TEXT_OVERWRITE for player in bravo},
+        {player: VOICE_OVERWRITE for player in alpha},
+        {player: VOICE_OVERWRITE for player in bravo},
+    ]
+
+
+async def add_overwrites(channels, overwrites, reason=None):
+    # one request per channel, keeping the overwrites the channel already has
+    coroutines = []
+    for channel, targets in zip(channels, overwrites):
+        if targets:
+            coroutines.append(
+                channel.edit(overwrites={**channel.overwrites, **targets}, reason=reason)
+            )
+    await asyncio.gather(*coroutines)
+
+
+class MatchPool:
+    """Keeps fully built match categories ready so a match only has to rename one.
+
+    Idle categories are copies of the match template named POOL_CATEGORY_NAME,
+    so they are found again after a restart.
+    """
+
+    def __init__(self):
+        self.idle = [] # (category id, channel ids in template order), oldest first
+        self.lock = asyncio.Lock()
+        self.loaded = False
+
+    def load(self, guild):
+        template_category = discord.utils.get(guild.categories, name=TEMPLATE_CATEGORY_NAME)
+        self.idle = []
+        for category in guild.categories:
+            if category.name == POOL_CATEGORY_NAME and len(category.channels) == len(template_category.channels):
+                self.idle.append((category.id, [channel.id for channel in category.channels]))
+        self.loaded = True
+
+    async def build(self, guild, name, reason, overwrites=None):
+        # each channel is created in the category with its overwrites, so there is nothing to move or permission after
+        template_category = discord.utils.get(guild.categories, name=TEMPLATE_CATEGORY_NAME)
+        category = await template_category.clone(name=name, reason=reason)
+        coroutines = []
+        for i, template in enumerate(template_category.channels):
+            channel_overwrites = dict(template.overwrites)
+            if overwrites:
+                channel_overwrites.update(overwrites[i])
+
+            # created at once, the template's positions keep them in template order in the category
+            if isinstance(template, discord.VoiceChannel):
+                coroutines.append(category.create_voice_channel(
+                    template.name, overwrites=channel_overwrites, reason=reason, position=template.position,
+                    bitrate=template.bitrate, user_limit=template.user_limit
+                ))
+            else:
+                coroutines.append(category.create_text_channel(
+                    template.name, overwrites=channel_overwrites, reason=reason, position=template.position,
+                    topic=template.topic, slowmode_delay=template.slowmode_delay, nsfw=template.nsfw
+                ))
+        channels = await asyncio.gather(*coroutines) # in the order given, which is template order
+        return category, list(channels)
+
+    async def fill(self, guild):
+        async with self.lock:
+            if not self.loaded:
+                self.load(guild)
+            while len(self.idle) < POOL_SIZE:
+                category, channels = await self.build(guild, POOL_CATEGORY_NAME, "Filling the match pool.")
+                self.idle.append((category.id, [channel.id for channel in channels]))
+
+    def replenish(self, guild):
+        asyncio.create_task(self.safe_fill(guild))
+
+    async def safe_fill(self, guild):
+        try:
+            await self.fill(guild)
+        except Exception as error:
+            logging.exception("Match pool fill error!", exc_info=error)
+
+    async def acquire(self, guild, name, reason, overwrites=None):
+        """Returns a category and its channels in template order, renamed to name.
+
+        overwrites are added to each channel, see match_overwrites.
+        """
+        template_category = discord.utils.get(guild.categories, name=TEMPLATE_CATEGORY_NAME)
+        while self.idle:
+            category_id, channel_ids = self.idle.pop(0)
+            category = guild.get_channel(category_id)
+            channels = [guild.get_channel(channel_id) for channel_id in channel_ids]
+            # deleted by hand, or the cache doesn't have the channels yet
+            if not category or None in channels or len(channels) != len(template_category.channels):
+                continue
+            try:
+                await asyncio.gather(
+                    category.edit(name=name, reason=reason),
+                    add_overwrites(channels, overwrites or [], reason),
+                )
+            except discord.NotFound:
+                continue
+            self.replenish(guild)
+            return category, channels
+
+        self.replenish(guild)
+        return await self.build(guild, name, reason, overwrites)
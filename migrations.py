@@ -0,0 +1,218 @@
+import logging
+
+from rating_utils import period_sums
+from event_bus import CHANNEL
+
+MIGRATION_LOCK = 7261001 # advisory lock id, so two bots starting at once don't both migrate
+
+
+
+async def backfill_period_sums(con):
+    # ratings from before migration 2 kept the period's games in arrays, turn them into the sums and drop the arrays
+    columns = await con.fetchval(
+        """SELECT count(*) FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'ratings'
+        AND column_name IN ('rating_list', 'deviation_list', 'outcome_list')"""
+    )
+    if columns < 3: # made by migration 1, never had them
+        await con.execute("ALTER TABLE ratings DROP COLUMN IF EXISTS rating_list, DROP COLUMN IF EXISTS deviation_list, DROP COLUMN IF EXISTS outcome_list")
+        return
+
+    rows = await con.fetch(
+        """SELECT user_id, mode, coalesce(rating_initial, rating) AS rating_initial, rating_list, deviation_list, outcome_list
+        FROM ratings WHERE cardinality(rating_list) > 0"""
+    )
+    values = [(row['user_id'], row['mode'], *period_sums(row['rating_initial'], row['rating_list'], row['deviation_list'], row['outcome_list']))
+        for row in rows]
+    if values:
+        await con.execute(
+            """UPDATE ratings SET variance_sum = ratings.variance_sum + new.variance_sum, improvement_sum = ratings.improvement_sum + new.improvement_sum
+            FROM unnest($1::bigint[], $2::varchar[], $3::double precision[], $4::double precision[]) AS new (user_id, mode, variance_sum, improvement_sum)
+            WHERE ratings.user_id = new.user_id AND ratings.mode = new.mode""",
+            *zip(*values)
+        )
+    logging.info(f"Moved the period's games of {len(values)} rating(s) into period sums.")
+    await con.execute("ALTER TABLE ratings DROP COLUMN rating_list, DROP COLUMN deviation_list, DROP COLUMN outcome_list")
+
+
+# version n is MIGRATIONS[n - 1] and runs once. Never change a migration that has been released, add a new one.
+# A migration is SQL or a coroutine function called with the connection, for changes that need python.
+# The tables existed before this file did, so the first migrations also have to work on a database that has them.
+MIGRATIONS = [
+    # 1: initial schema
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id bigint PRIMARY KEY,
+        host_pref smallint NOT NULL,
+        register_date timestamptz NOT NULL,
+        friend_code varchar,
+        last_played timestamptz,
+        queue_disable_time timestamptz
+    );
+
+    CREATE TABLE IF NOT EXISTS modes (
+        internal_name varchar PRIMARY KEY,
+        name varchar NOT NULL,
+        description text,
+        description_brief varchar,
+        status smallint NOT NULL DEFAULT 0,
+        sort_order integer NOT NULL DEFAULT 0,
+        emoji_id bigint,
+        image_url text,
+        thumbnail text,
+        maplist varchar NOT NULL,
+        format varchar[] NOT NULL,
+        games integer NOT NULL,
+        play_all_games boolean NOT NULL DEFAULT false,
+        rating_period_hours integer NOT NULL DEFAULT 24,
+        last_rating_period timestamptz
+    );
+
+    CREATE TABLE IF NOT EXISTS ratings (
+        user_id bigint NOT NULL,
+        mode varchar NOT NULL,
+        rating double precision NOT NULL,
+        deviation double precision NOT NULL,
+        volatility double precision NOT NULL,
+        rating_initial double precision,
+        deviation_initial double precision,
+        volatility_initial double precision
+    );
+
+    CREATE TABLE IF NOT EXISTS queue (
+        modes varchar[] NOT NULL,
+        player_count integer NOT NULL,
+        player_ids bigint[] NOT NULL,
+        join_date timestamptz NOT NULL,
+        available boolean NOT NULL DEFAULT true
+    );
+
+    CREATE TABLE IF NOT EXISTS games (
+        id serial PRIMARY KEY,
+        mode varchar NOT NULL,
+        host bigint,
+        alpha_players bigint[] NOT NULL,
+        bravo_players bigint[] NOT NULL,
+        score integer[] NOT NULL,
+        start_date timestamptz NOT NULL,
+        end_date timestamptz,
+        submit_time timestamptz,
+        game_active boolean NOT NULL DEFAULT true,
+        admin_locked boolean NOT NULL DEFAULT false,
+        alpha_ratings double precision[],
+        alpha_deviations double precision[],
+        alpha_volatilities double precision[],
+        bravo_ratings double precision[],
+        bravo_deviations double precision[],
+        bravo_volatilities double precision[],
+        game_maps varchar[],
+        game_modes varchar[]
+    );
+    """,
+
+    # 2: rating period sums (see rating_utils.period_sums), map seeds and score versions
+    """
+    ALTER TABLE ratings ADD COLUMN IF NOT EXISTS variance_sum double precision NOT NULL DEFAULT 0;
+    ALTER TABLE ratings ADD COLUMN IF NOT EXISTS improvement_sum double precision NOT NULL DEFAULT 0;
+    ALTER TABLE games ADD COLUMN IF NOT EXISTS map_seed bigint;
+    ALTER TABLE games ADD COLUMN IF NOT EXISTS score_version integer NOT NULL DEFAULT 0;
+    """,
+
+    # 3: indexes for the queries in the cogs, queries must use the same expressions and conditions to use them
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'ratings'::regclass AND contype = 'p') THEN
+            -- grab_player_data could insert a rating twice, keep one row per player and mode so the key can be added
+            DELETE FROM ratings a USING ratings b WHERE a.user_id = b.user_id AND a.mode = b.mode AND a.ctid < b.ctid;
+            ALTER TABLE ratings ADD PRIMARY KEY (user_id, mode);
+        END IF;
+    END;
+    $$;
+    CREATE INDEX IF NOT EXISTS ratings_mode_idx ON ratings (mode);
+    CREATE INDEX IF NOT EXISTS queue_player_ids_idx ON queue USING gin (player_ids);
+    CREATE INDEX IF NOT EXISTS games_active_players_idx ON games USING gin ((alpha_players || bravo_players)) WHERE game_active;
+    CREATE INDEX IF NOT EXISTS games_active_submit_time_idx ON games (submit_time) WHERE game_active;
+    CREATE INDEX IF NOT EXISTS games_active_mode_idx ON games (mode) WHERE game_active;
+    """,
+
+    # 4: how far from their rating groups search as they wait, see queue_engine.SearchCurve
+    """
+    ALTER TABLE modes ADD COLUMN search_range double precision NOT NULL DEFAULT 200;
+    ALTER TABLE modes ADD COLUMN search_range_growth double precision NOT NULL DEFAULT 25;
+    ALTER TABLE modes ADD COLUMN search_range_max double precision NOT NULL DEFAULT 600;
+    """,
+
+    # 5: games played before migration 2 in the current rating period
+    backfill_period_sums,
+
+    # 6: every write to these tables is sent to CHANNEL, so changes from any connection (or by hand) reach the cogs
+    f"""
+    CREATE OR REPLACE FUNCTION beam_net_notify_queue() RETURNS trigger AS $$
+    DECLARE
+        changed queue;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN changed := OLD; ELSE changed := NEW; END IF;
+        PERFORM pg_notify('{CHANNEL}', json_build_object(
+            'table', 'queue', 'op', TG_OP, 'player_ids', changed.player_ids, 'modes', changed.modes,
+            'join_date', extract(epoch FROM changed.join_date), 'available', changed.available
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION beam_net_notify_games() RETURNS trigger AS $$
+    DECLARE
+        changed games;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN changed := OLD; ELSE changed := NEW; END IF;
+        IF TG_OP = 'UPDATE' AND NEW.submit_time IS NOT DISTINCT FROM OLD.submit_time AND NEW.game_active = OLD.game_active THEN
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('{CHANNEL}', json_build_object(
+            'table', 'games', 'op', TG_OP, 'id', changed.id, 'mode', changed.mode, 'game_active', changed.game_active,
+            'was_active', TG_OP <> 'INSERT' AND OLD.game_active, 'submit_time', extract(epoch FROM changed.submit_time),
+            'player_count', cardinality(changed.alpha_players) + cardinality(changed.bravo_players)
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION beam_net_notify_modes() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CHANNEL}', json_build_object(
+            'table', 'modes', 'op', TG_OP, 'internal_name', CASE WHEN TG_OP = 'DELETE' THEN OLD.internal_name ELSE NEW.internal_name END
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS beam_net_notify ON queue;
+    CREATE TRIGGER beam_net_notify AFTER INSERT OR UPDATE OR DELETE ON queue FOR EACH ROW EXECUTE FUNCTION beam_net_notify_queue();
+    DROP TRIGGER IF EXISTS beam_net_notify ON games;
+    CREATE TRIGGER beam_net_notify AFTER INSERT OR UPDATE OR DELETE ON games FOR EACH ROW EXECUTE FUNCTION beam_net_notify_games();
+    DROP TRIGGER IF EXISTS beam_net_notify ON modes;
+    CREATE TRIGGER beam_net_notify AFTER INSERT OR UPDATE OR DELETE ON modes FOR EACH ROW EXECUTE FUNCTION beam_net_notify_modes();
+    """,
+]
+
+
+async def migrate(pg_con):
+    """Bring the database up to the latest schema version."""
+    async with pg_con.acquire() as con:
+        async with con.transaction():
+            await con.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+            await con.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations (version integer PRIMARY KEY, applied_date timestamptz NOT NULL DEFAULT now())"
+            )
+            version = await con.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+
+            for i in range(version, len(MIGRATIONS)):
+                logging.info(f"Applying database migration {i + 1}.")
+                if isinstance(MIGRATIONS[i], str):
+                    await con.execute(MIGRATIONS[i])
+                else:
+                    await MIGRATIONS[i](con)
+                await con.execute("INSERT INTO schema_migrations (version) VALUES ($1)", i + 1)
+
+    if version < len(MIGRATIONS):
+        logging.info(f"Database migrated from version {version} to {len(MIGRATIONS)}.")
@@ -0,0 +1,45 @@
+class ModeCounters:
+    """Searching and in-game player counts for every mode.
+
+    Counts are kept up to date from queue and games events and reconciled
+    against the database with a single grouped query by refresh.
+    """
+
+    def __init__(self):
+        self.searching = {} # mode -> queued groups
+        self.in_game = {} # mode -> players in active games
+
+    def get(self, mode):
+        return self.searching.get(mode, 0), self.in_game.get(mode, 0)
+
+    async def refresh(self, pg_con):
+        rows = await pg_con.fetch(
+            """SELECT mode, sum(searching)::int AS searching, sum(in_game)::int AS in_game FROM (
+                SELECT queue_mode AS mode, 1 AS searching, 0 AS in_game FROM queue, unnest(queue.modes) AS queue_mode
+                UNION ALL
+                SELECT mode, 0, cardinality(alpha_players) + cardinality(bravo_players) FROM games WHERE game_active = true
+            ) counts GROUP BY mode"""
+        )
+        self.searching = {}
+        self.in_game = {}
+        for row in rows:
+            self.searching[row['mode']] = row['searching']
+            self.in_game[row['mode']] = row['in_game']
+
+    async def on_queue_event(self, event):
+        if event['op'] == 'INSERT':
+            change = 1
+        elif event['op'] == 'DELETE':
+            change = -1
+        else:
+            return
+        for mode in event['modes']:
+            self.searching[mode] = max(self.searching.get(mode, 0) + change, 0)
+
+    async def on_games_event(self, event):
+        was_active = event['was_active']
+        is_active = event['game_active'] and event['op'] != 'DELETE'
+        if was_active == is_active:
+            return
+        change = event['player_count'] if is_active else -event['player_count']
+        self.in_game[event['mode']] = max(self.in_game.get(event['mode'], 0) + change, 0)
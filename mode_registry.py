@@ -0,0 +1,61 @@
+import logging
+
+
+class ModeRegistry:
+    """Every row of the modes table, held in memory.
+
+    Modes are the asyncpg records themselves, so they are read only and are
+    used like mode['name']. The whole table is reloaded when a mode changes,
+    after which the registry's own subscribers are called, so they always
+    see the new modes.
+    """
+
+    def __init__(self):
+        self.pg_con = None
+        self.modes = {} # internal_name -> mode
+        self.ordered = () # by sort_order
+        self.handlers = []
+
+    async def load(self, pg_con):
+        self.pg_con = pg_con
+        await self.refresh()
+
+    async def refresh(self):
+        rows = await self.pg_con.fetch("SELECT * FROM modes ORDER BY sort_order ASC")
+        # replace both at once so readers never see half a refresh
+        self.modes = {mode['internal_name']: mode for mode in rows}
+        self.ordered = tuple(rows)
+        logging.info(f"Loaded {len(rows)} mode(s).")
+
+    def get(self, internal_name):
+        return self.modes.get(internal_name)
+
+    def get_many(self, internal_names):
+        # skips names that aren't modes
+        return [self.modes[name] for name in internal_names if name in self.modes]
+
+    def all(self):
+        return self.ordered
+
+    def with_status(self, status):
+        return [mode for mode in self.ordered if mode['status'] == status]
+
+    def subscribe(self, handler):
+        # handler is a coroutine function called with the modes event after each refresh
+        self.handlers.append(handler)
+
+    def unsubscribe(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    async def on_reconnect(self):
+        # mode events may have been missed while the event bus was down
+        await self.on_modes_event({'table': 'modes', 'op': 'REFRESH', 'internal_name': None})
+
+    async def on_modes_event(self, event):
+        await self.refresh()
+        for handler in list(self.handlers):
+            try:
+                await handler(event)
+            except Exception as error:
+                logging.exception("Mode registry handler error!", exc_info=error)
@@ -0,0 +1,300 @@
+from bisect import bisect_left, insort
+import math
+
+PLAYERS_PER_MATCH = 8
+TEAM_SIZE = PLAYERS_PER_MATCH // 2
+DEFAULT_RATING = 1500.0
+RATING_RANGE = 200.0 # the furthest any group in a match can be from the rating of the group it was anchored on
+BUCKET_SECONDS = 15 # wait times are counted in whole buckets, so search ranges only widen once per bucket
+
+
+class SearchCurve:
+    """How far from its rating a group will search as it waits.
+
+    The range starts at base and grows by growth every minute up to limit.
+    """
+    __slots__ = ("base", "growth", "limit")
+
+    def __init__(self, base=RATING_RANGE, growth=0.0, limit=None):
+        self.base = base
+        self.growth = growth
+        self.limit = base if limit is None else max(limit, base)
+
+    def range(self, waited_buckets):
+        return min(self.base + self.growth * waited_buckets * BUCKET_SECONDS / 60, self.limit)
+
+    def growing_buckets(self):
+        # how many buckets of waiting it takes to reach limit
+        if self.growth <= 0:
+            return 0
+        return math.ceil((self.limit - self.base) * 60 / (self.growth * BUCKET_SECONDS))
+
+
+DEFAULT_CURVE = SearchCurve()
+
+
+class QueueGroup:
+    __slots__ = ("player_ids", "modes", "join_date", "ratings", "available")
+
+    def __init__(self, player_ids, modes, join_date, ratings, available=True):
+        self.player_ids = list(player_ids)
+        self.modes = list(modes)
+        self.join_date = join_date
+        self.ratings = ratings # mode -> average rating of the group in that mode
+        self.available = available
+
+    @property
+    def leader_id(self):
+        return self.player_ids[0]
+
+    @property
+    def size(self):
+        return len(self.player_ids)
+
+
+def can_split(sizes):
+    # whether groups of these sizes fit on two teams without splitting any group
+    reachable = {0} # players that can be put on alpha
+    for size in sizes:
+        reachable |= {total + size for total in reachable if total + size <= TEAM_SIZE}
+    return any(sum(sizes) - total <= TEAM_SIZE for total in reachable)
+
+
+class QueueEngine:
+    """In-memory copy of the queue table, indexed per mode by rating.
+
+    The queue table stays the durable record. Cogs mirror every change they
+    write to it here, and the matchmaker resyncs from it on startup.
+    """
+
+    def __init__(self):
+        self.groups = {}  # leader id -> group
+        self.members = {} # player id -> leader id
+        self.index = {}   # mode -> sorted list of (rating, leader id) for available groups
+        self.waiting = {} # mode -> leader ids of available groups in queue order
+        self.buckets = {} # mode -> join date bucket -> leader ids of available groups
+        self.changed = set() # modes with groups made available since they were last searched
+        self.searched = {} # mode -> bucket of the last search
+
+    def __len__(self):
+        return len(self.groups)
+
+    def _bucket(self, group):
+        return int(group.join_date.timestamp() // BUCKET_SECONDS)
+
+    def _index_group(self, group):
+        for mode in group.modes:
+            insort(self.index.setdefault(mode, []), (group.ratings[mode], group.leader_id))
+            self.waiting.setdefault(mode, {})[group.leader_id] = None
+            self.buckets.setdefault(mode, {}).setdefault(self._bucket(group), {})[group.leader_id] = None
+            self.changed.add(mode)
+
+    def _unindex_group(self, group):
+        for mode in group.modes:
+            ratings = self.index.get(mode, [])
+            key = (group.ratings[mode], group.leader_id)
+            i = bisect_left(ratings, key)
+            if i < len(ratings) and ratings[i] == key:
+                del ratings[i]
+            self.waiting.get(mode, {}).pop(group.leader_id, None)
+            buckets = self.buckets.get(mode, {})
+            bucket = self._bucket(group)
+            if bucket in buckets:
+                buckets[bucket].pop(group.leader_id, None)
+                if not buckets[bucket]:
+                    del buckets[bucket]
+
+    def add(self, group):
+        self.remove(group.leader_id)
+        self.groups[group.leader_id] = group
+        for player_id in group.player_ids:
+            self.members[player_id] = group.leader_id
+        if group.available:
+            self._index_group(group)
+
+    def get(self, player_id):
+        leader_id = self.members.get(player_id)
+        if leader_id is None:
+            return None
+        return self.groups[leader_id]
+
+    def remove(self, player_id):
+        group = self.get(player_id)
+        if not group:
+            return None
+        if group.available:
+            self._unindex_group(group)
+        for member_id in group.player_ids:
+            self.members.pop(member_id, None)
+        del self.groups[group.leader_id]
+        return group
+
+    def set_available(self, player_ids, available):
+        for player_id in player_ids:
+            group = self.get(player_id)
+            if not group or group.available == available:
+                continue
+            group.available = available
+            if available:
+                self._index_group(group)
+            else:
+                self._unindex_group(group)
+
+    def clear(self):
+        self.groups.clear()
+        self.members.clear()
+        self.index.clear()
+        self.waiting.clear()
+        self.buckets.clear()
+        self.changed.clear()
+        self.searched.clear()
+
+    def find_match(self, mode, anchor, current, curve=DEFAULT_CURVE):
+        # take the closest rated groups around the anchor that are in each other's search range
+        # current is the bucket now, every group's range is how long it has waited on curve
+        search_range = curve.range(current - self._bucket(anchor))
+        ratings = self.index[mode]
+        anchor_rating = anchor.ratings[mode]
+        if anchor.size > TEAM_SIZE:
+            return None
+
+        match = [anchor]
+        sizes = [anchor.size]
+        remaining = PLAYERS_PER_MATCH - anchor.size
+
+        pos = bisect_left(ratings, (anchor_rating, anchor.leader_id))
+        low = pos - 1
+        high = pos + 1
+        while remaining > 0:
+            low_diff = anchor_rating - ratings[low][0] if low >= 0 else None
+            high_diff = ratings[high][0] - anchor_rating if high < len(ratings) else None
+            if low_diff is None and high_diff is None:
+                break
+
+            if high_diff is None or (low_diff is not None and low_diff <= high_diff):
+                diff, leader_id = low_diff, ratings[low][1]
+                low -= 1
+            else:
+                diff, leader_id = high_diff, ratings[high][1]
+                high += 1
+
+            if diff > search_range:
+                break
+            group = self.groups[leader_id]
+            if diff > curve.range(current - self._bucket(group)):
+                continue # the anchor is outside of this group's own range
+            # skip groups that would leave no way to split the match into two teams
+            if group.size <= remaining and can_split(sizes + [group.size]):
+                match.append(group)
+                sizes.append(group.size)
+                remaining -= group.size
+
+        if remaining == 0:
+            return match
+        return None
+
+    def pop_matches(self, mode, now, curve=DEFAULT_CURVE):
+        """Find every match that can be made in mode and reserve its groups.
+
+        Groups are anchored on in queue order and only match groups that are
+        within each other's range, which grows with how long each has waited.
+        Everyone is searched again only when a group was made available,
+        otherwise only groups whose range grew since the last search can make
+        a new match, so most calls look at nobody.
+        """
+        current = int(now.timestamp() // BUCKET_SECONDS)
+        previous = self.searched.get(mode)
+        if mode in self.changed or previous is None:
+            anchor_ids = list(self.waiting.get(mode, {}))
+        elif current != previous:
+            growing = previous - curve.growing_buckets()
+            anchor_ids = []
+            for bucket in sorted(self.buckets.get(mode, {})):
+                if bucket > growing:
+                    anchor_ids += self.buckets[mode][bucket]
+        else:
+            return []
+        self.changed.discard(mode)
+        self.searched[mode] = current
+
+        matches = []
+        for anchor_id in anchor_ids:
+            anchor = self.groups.get(anchor_id)
+            if not anchor or not anchor.available:
+                continue # matched as part of an earlier match
+            match = self.find_match(mode, anchor, current, curve)
+            if match:
+                # reserve the groups so they can't be matched twice
+                for group in match:
+                    self.set_available(group.player_ids, False)
+                matches.append(match)
+        return matches
+
+    async def load_ratings(self, pg_con, player_ids, modes):
+        rows = await pg_con.fetch(
+            "SELECT user_id, mode, rating FROM ratings WHERE user_id = ANY ($1::bigint[]) AND mode = ANY ($2::varchar[])",
+            player_ids, modes
+        )
+        ratings = {}
+        for row in rows:
+            ratings[(row['user_id'], row['mode'])] = row['rating']
+        return ratings
+
+    def build_group(self, player_ids, modes, join_date, ratings, available=True):
+        group_ratings = {}
+        for mode in modes:
+            total = 0
+            for player_id in player_ids:
+                total += ratings.get((player_id, mode), DEFAULT_RATING)
+            group_ratings[mode] = total / len(player_ids)
+        return QueueGroup(player_ids, modes, join_date, group_ratings, available)
+
+    async def load_group(self, pg_con, player_ids, modes, join_date):
+        ratings = await self.load_ratings(pg_con, player_ids, modes)
+        group = self.build_group(player_ids, modes, join_date, ratings)
+        self.add(group)
+        return group
+
+    # queue table writes for a whole lobby at once, mirrored into the engine
+
+    async def reserve(self, pg_con, player_ids):
+        await pg_con.execute(
+            "UPDATE queue SET available = false WHERE player_ids && $1::bigint[] AND available = true",
+            player_ids
+        )
+        self.set_available(player_ids, False)
+
+    async def release(self, pg_con, player_ids):
+        await pg_con.execute(
+            "UPDATE queue SET available = true WHERE player_ids && $1::bigint[]",
+            player_ids
+        )
+        self.set_available(player_ids, True)
+
+    async def release_all(self, pg_con):
+        # reservations left by a restart during a ready check, nothing can be reserved before the bot is up
+        await pg_con.execute("UPDATE queue SET available = true WHERE available = false")
+        for group in list(self.groups.values()):
+            self.set_available(group.player_ids, True)
+
+    async def dequeue(self, pg_con, player_ids):
+        await pg_con.execute(
+            "DELETE FROM queue WHERE player_ids && $1::bigint[]",
+            player_ids
+        )
+        for player_id in player_ids:
+            self.remove(player_id)
+
+    async def sync(self, pg_con):
+        # rebuild the engine from the queue table
+        rows = await pg_con.fetch("SELECT modes, player_ids, join_date, available FROM queue ORDER BY join_date ASC")
+        player_ids = []
+        modes = set()
+        for row in rows:
+            player_ids += row['player_ids']
+            modes.update(row['modes'])
+        ratings = await self.load_ratings(pg_con, player_ids, list(modes)) if rows else {}
+
+        self.clear()
+        for row in rows:
+            self.add(self.build_group(row['player_ids'], row['modes'], row['join_date'], ratings, row['available']))
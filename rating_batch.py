@@ -0,0 +1,136 @@
+import numpy as np
+
+from rating_utils import GLICKO2_SCALE, TAU
+
+MAX_DEVIATION = 350.0
+
+
+def decay_deviation(deviation, volatility, periods=1):
+    # glicko2.Player.did_not_compete for every player at once, capped at MAX_DEVIATION after each period
+    phi = np.asarray(deviation, dtype=np.float64) / GLICKO2_SCALE
+    vol_squared = np.square(np.asarray(volatility, dtype=np.float64))
+    cap = MAX_DEVIATION / GLICKO2_SCALE
+    for i in range(periods):
+        phi = np.minimum(np.sqrt(phi ** 2 + vol_squared), cap)
+    return phi * GLICKO2_SCALE
+
+
+def rollover(rating, deviation, volatility, variance_sum, periods=1):
+    """Advance a mode's ratings by one or more rating periods.
+
+    Players with no games in the current period (variance_sum of 0) get one
+    period of inactivity, and everyone gets one more for each extra period
+    being caught up on. Ratings of players who played are already final
+    since close_game keeps them up to date. Returns the new rating,
+    deviation and volatility arrays, which also start the next period.
+    """
+    rating = np.asarray(rating, dtype=np.float64)
+    deviation = np.asarray(deviation, dtype=np.float64)
+    volatility = np.asarray(volatility, dtype=np.float64)
+    if periods < 1:
+        return rating, deviation, volatility
+
+    inactive = np.asarray(variance_sum, dtype=np.float64) == 0
+    deviation = np.where(inactive, decay_deviation(deviation, volatility), deviation)
+    deviation = decay_deviation(deviation, volatility, periods - 1)
+    return rating, deviation, volatility
+
+
+def _g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+
+def new_volatility(mu, phi, vol, delta, v):
+    # rating_utils._new_vol for arrays, each element stops once it has converged
+    eps = 0.000001
+    a = np.log(vol ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - mu ** 2 - v - ex) / (2 * (mu ** 2 + v + ex) ** 2) - (x - a) / TAU ** 2
+
+    with np.errstate(divide='ignore', invalid='ignore'): # from elements that are already done
+        bracketed = delta ** 2 > phi ** 2 + v
+        B = np.log(np.where(bracketed, delta ** 2 - phi ** 2 - v, 1.0))
+        k = np.ones_like(a)
+        searching = ~bracketed
+        while True:
+            searching &= f(a - k * TAU) < 0
+            if not searching.any():
+                break
+            k += searching
+        B = np.where(bracketed, B, a - k * TAU)
+
+        A = a.copy()
+        fA = f(A)
+        fB = f(B)
+        active = np.abs(B - A) > eps
+        while active.any():
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            swap = fC * fB <= 0
+            A = np.where(active & swap, B, A)
+            fA = np.where(active, np.where(swap, fB, fA / 2), fA)
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+            active = np.abs(B - A) > eps
+    return np.exp(A / 2)
+
+
+def rate_periods(rating_initial, deviation_initial, volatility_initial, variance_sum, improvement_sum):
+    """rating_utils.rate_period for arrays of any shape."""
+    rating_initial = np.asarray(rating_initial, dtype=np.float64)
+    deviation_initial = np.asarray(deviation_initial, dtype=np.float64)
+    volatility_initial = np.asarray(volatility_initial, dtype=np.float64)
+    variance_sum = np.asarray(variance_sum, dtype=np.float64)
+    improvement_sum = np.asarray(improvement_sum, dtype=np.float64)
+
+    played = variance_sum != 0
+    mu = (rating_initial - 1500) / GLICKO2_SCALE
+    phi = deviation_initial / GLICKO2_SCALE
+    v = 1 / np.where(played, variance_sum, 1.0)
+
+    vol = new_volatility(mu, phi, volatility_initial, v * improvement_sum, v)
+    phi = np.sqrt(phi ** 2 + vol ** 2)
+    phi = 1 / np.sqrt(1 / phi ** 2 + 1 / v)
+    mu = mu + phi ** 2 * improvement_sum
+    return (
+        np.where(played, mu * GLICKO2_SCALE + 1500, rating_initial),
+        np.where(played, phi * GLICKO2_SCALE, deviation_initial),
+        np.where(played, vol, volatility_initial),
+    )
+
+
+def score_lobbies(ratings, deviations, volatilities, wins=3, losses=1):
+    """rating_utils.worth_playing for many lobbies at once.
+
+    Arrays have shape (lobbies, 8) with alpha first. Each player is rated
+    as if their team won wins games and lost losses games, against the
+    same opponent close_game would rate them against. Returns the rating
+    change of every player and the quality of each lobby, the smallest
+    change in it. A lobby is worth playing if its quality is not negative.
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    deviations = np.asarray(deviations, dtype=np.float64)
+    volatilities = np.asarray(volatilities, dtype=np.float64)
+    team_size = ratings.shape[-1] // 2
+
+    team_sums = np.stack((ratings[..., :team_size].sum(axis=-1), ratings[..., team_size:].sum(axis=-1)), axis=-1)
+    team_sums = np.repeat(team_sums, team_size, axis=-1)
+    opponent_sums = np.flip(team_sums, axis=-1)
+    opponent = opponent_sums - (team_sums - ratings) # create_player's rating
+
+    # the average deviation of everyone else in the lobby
+    rd = (deviations.sum(axis=-1, keepdims=True) - deviations) / (ratings.shape[-1] - 1)
+
+    # period_sums for wins + losses games against the same opponent
+    mu = (ratings - 1500) / GLICKO2_SCALE
+    g = _g(rd / GLICKO2_SCALE)
+    e = 1 / (1 + np.exp(-g * (mu - (opponent - 1500) / GLICKO2_SCALE)))
+    variance_sum = (wins + losses) * g ** 2 * e * (1 - e)
+    improvement_sum = g * (wins - (wins + losses) * e)
+
+    new_ratings, new_deviations, new_volatilities = rate_periods(ratings, deviations, volatilities, variance_sum, improvement_sum)
+    changes = new_ratings - ratings
+    return changes, changes.min(axis=-1)
+
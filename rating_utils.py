@@ -1,4 +1,9 @@
 from glicko2 import Player
+import math
+
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
 
 def create_player(teammates_rating, opponents_rating, RD_list, wins, losses):
     r = opponents_rating - teammates_rating
@@ -29,7 +34,7 @@ def worth_playing(players):
             opponents_ratings.append(players[index].rating)
             RD_list.append(players[index].rd)
         
-        ratings, rds, outcomes = create_player(teammates_ratings, opponents_ratings, RD_list, 3, 1)
+        ratings, rds, outcomes = create_player(sum(teammates_ratings), sum(opponents_ratings), RD_list, 3, 1)
 
         player_sim = Player()
         player_sim.rating = players[i].rating
@@ -40,4 +45,86 @@ def worth_playing(players):
         if player_sim.rating < players[i].rating:
             print(i)
             return False
-    return True
\ No newline at end of file
+    return True
+
+
+# the functions below mirror glicko2.Player so ratings match replaying the whole period with update_player
+GLICKO2_SCALE = 173.7178
+TAU = Player._tau
+
+def _g(phi):
+    return 1 / math.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+
+def period_sums(rating_initial, rating_list, RD_list, outcome_list):
+    # the variance and improvement sums of a set of results, rated against the player's rating at the start of the period
+    mu = (rating_initial - 1500) / GLICKO2_SCALE
+    variance_sum = 0
+    improvement_sum = 0
+    for rating, rd, outcome in zip(rating_list, RD_list, outcome_list):
+        g = _g(rd / GLICKO2_SCALE)
+        e = 1 / (1 + math.exp(-g * (mu - (rating - 1500) / GLICKO2_SCALE)))
+        variance_sum += g ** 2 * e * (1 - e)
+        improvement_sum += g * (outcome - e)
+    return variance_sum, improvement_sum
+
+def _new_vol(mu, phi, vol, delta, v):
+    # same as glicko2.Player._newVol, including its use of the rating in f
+    a = math.log(vol ** 2)
+    eps = 0.000001
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta ** 2 - mu ** 2 - v - ex) / (2 * (mu ** 2 + v + ex) ** 2) - (x - a) / TAU ** 2
+
+    A = a
+    if delta ** 2 > phi ** 2 + v:
+        B = math.log(delta ** 2 - phi ** 2 - v)
+    else:
+        k = 1
+        while f(a - k * TAU) < 0:
+            k += 1
+        B = a - k * TAU
+
+    fA = f(A)
+    fB = f(B)
+    while math.fabs(B - A) > eps:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A = B
+            fA = fB
+        else:
+            fA = fA / 2
+        B = C
+        fB = fC
+    return math.exp(A / 2)
+
+def rate_period(rating_initial, deviation_initial, volatility_initial, variance_sum, improvement_sum):
+    # rating, deviation and volatility after the games summed so far in the period
+    if variance_sum == 0:
+        return rating_initial, deviation_initial, volatility_initial
+
+    mu = (rating_initial - 1500) / GLICKO2_SCALE
+    phi = deviation_initial / GLICKO2_SCALE
+    v = 1 / variance_sum
+
+    vol = _new_vol(mu, phi, volatility_initial, v * improvement_sum, v)
+    phi = math.sqrt(phi ** 2 + vol ** 2)
+    phi = 1 / math.sqrt(1 / phi ** 2 + 1 / v)
+    mu += phi ** 2 * improvement_sum
+    return mu * GLICKO2_SCALE + 1500, phi * GLICKO2_SCALE, vol
+
+
+async def load_ratings(pg_con, player_ids, mode):
+    """Returns user_id -> ratings row for mode, giving players without a rating the default one."""
+    async with pg_con.acquire() as con:
+        await con.execute(
+            """INSERT INTO ratings (user_id, mode, rating, deviation, volatility)
+            SELECT user_id, $2, $3, $4, $5 FROM unnest($1::bigint[]) AS user_id ON CONFLICT DO NOTHING""",
+            player_ids, mode, DEFAULT_RATING, DEFAULT_DEVIATION, DEFAULT_VOLATILITY
+        )
+        rows = await con.fetch(
+            "SELECT user_id, mode, rating, deviation, volatility FROM ratings WHERE user_id = ANY ($1::bigint[]) AND mode = $2",
+            player_ids, mode
+        )
+    return {row['user_id']: row for row in rows}
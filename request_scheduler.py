@@ -0,0 +1,128 @@
+import discord
+
+from collections import deque
+import logging, asyncio, time
+
+# lanes, lower runs first
+CRITICAL = 0 # ready checks and match creation
+NORMAL = 1 # result messages and voice moves
+LOW = 2 # mode board edits and pins
+LANES = (CRITICAL, NORMAL, LOW)
+
+LANE_LIMITS = {NORMAL: 4, LOW: 2} # requests running at once, critical requests are never held back
+DEFAULT_RETRY_SECONDS = 1.0
+
+
+class _Request:
+    __slots__ = ("lane", "route", "factory", "key", "futures")
+
+    def __init__(self, lane, route, factory, key):
+        self.lane = lane
+        self.route = route
+        self.factory = factory
+        self.key = key
+        self.futures = []
+
+
+class RequestScheduler:
+    """Runs Discord API calls by priority lane, one at a time per route.
+
+    A route names the rate limit bucket a call uses, like "channel:<id>".
+    Calls are given as a function that returns the coroutine so they are
+    only started when their turn comes. A pending call with the same key
+    as a new one is replaced by it, so only the newest edit of a message
+    is sent.
+    """
+
+    def __init__(self):
+        self.pending = {lane: deque() for lane in LANES}
+        self.keys = {} # key -> pending request
+        self.running = {lane: 0 for lane in LANES}
+        self.busy_routes = set()
+        self.blocked_routes = {} # route -> time.monotonic() when it can be used again
+        self.wakeup = None
+
+    def depth(self):
+        # pending requests in each lane
+        return {lane: len(requests) for lane, requests in self.pending.items()}
+
+    def submit(self, lane, route, factory, key=None):
+        """Queue a call without waiting for it, errors are logged."""
+        self._queue(lane, route, factory, key)
+
+    async def run(self, lane, route, factory, key=None):
+        """Queue a call and return its result once it has run."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue(lane, route, factory, key, future)
+        return await future
+
+    def _queue(self, lane, route, factory, key, future=None):
+        request = self.keys.get(key) if key else None
+        if request:
+            # superseded, the waiting callers get the result of the newest call
+            request.factory = factory
+            if lane < request.lane:
+                self.pending[request.lane].remove(request)
+                request.lane = lane
+                self.pending[lane].append(request)
+        else:
+            request = _Request(lane, route, factory, key)
+            self.pending[lane].append(request)
+            if key:
+                self.keys[key] = request
+        if future:
+            request.futures.append(future)
+        self._pump()
+
+    def _pump(self):
+        now = time.monotonic()
+        next_unblock = None
+        for lane in LANES:
+            requests = self.pending[lane]
+            limit = LANE_LIMITS.get(lane)
+            for request in list(requests):
+                if limit is not None and self.running[lane] >= limit:
+                    break
+                if request.route in self.busy_routes:
+                    continue
+                blocked_until = self.blocked_routes.get(request.route)
+                if blocked_until:
+                    if blocked_until > now:
+                        next_unblock = min(next_unblock or blocked_until, blocked_until)
+                        continue
+                    del self.blocked_routes[request.route]
+
+                requests.remove(request)
+                if request.key:
+                    del self.keys[request.key]
+                self.running[lane] += 1
+                self.busy_routes.add(request.route)
+                asyncio.create_task(self._execute(request))
+
+        if next_unblock and not self.wakeup:
+            self.wakeup = asyncio.get_running_loop().call_later(next_unblock - now, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self.wakeup = None
+        self._pump()
+
+    async def _execute(self, request):
+        try:
+            result = await request.factory()
+        except Exception as error:
+            if isinstance(error, discord.HTTPException) and error.status == 429:
+                retry_after = error.response.headers.get('Retry-After') if error.response else None
+                self.blocked_routes[request.route] = time.monotonic() + float(retry_after or DEFAULT_RETRY_SECONDS)
+            if not request.futures:
+                logging.exception(f"Request error on route \"{request.route}\"!", exc_info=error)
+            for future in request.futures:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.running[request.lane] -= 1
+            self.busy_routes.discard(request.route)
+            self._pump()
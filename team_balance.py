@@ -0,0 +1,76 @@
+import numpy as np
+
+from itertools import combinations
+import math
+
+from rating_utils import GLICKO2_SCALE
+
+TEAM_SIZE = 4
+LOBBY_SIZE = TEAM_SIZE * 2
+
+# every split of a lobby with player 0 on alpha, so swapped teams aren't counted twice (35 splits)
+ALPHA_SPLITS = np.array([(0,) + rest for rest in combinations(range(1, LOBBY_SIZE), TEAM_SIZE - 1)])
+SPLIT_MASKS = np.zeros((len(ALPHA_SPLITS), LOBBY_SIZE), dtype=bool) # True for players on alpha
+SPLIT_MASKS[np.arange(len(ALPHA_SPLITS))[:, None], ALPHA_SPLITS] = True
+BRAVO_SPLITS = np.array([np.flatnonzero(~mask) for mask in SPLIT_MASKS])
+
+
+def win_probabilities(ratings, deviations):
+    """Alpha's expected score for every split of each lobby.
+
+    ratings and deviations have shape (lobbies, 8) and the result has shape
+    (lobbies, 35). Teams are compared by their average glicko-2 rating, with
+    the uncertainty of the difference between the two averages.
+    """
+    mu = (np.asarray(ratings, dtype=np.float64) - 1500) / GLICKO2_SCALE
+    phi = np.asarray(deviations, dtype=np.float64) / GLICKO2_SCALE
+
+    alpha = SPLIT_MASKS.astype(np.float64).T / TEAM_SIZE
+    bravo = (~SPLIT_MASKS).astype(np.float64).T / TEAM_SIZE
+    difference = mu @ alpha - mu @ bravo
+
+    team_phi = np.sqrt(np.sum(phi ** 2, axis=-1, keepdims=True)) / TEAM_SIZE
+    g = 1 / np.sqrt(1 + 3 * team_phi ** 2 / math.pi ** 2)
+    return 1 / (1 + np.exp(-g * difference))
+
+
+def allowed_splits(parties):
+    # splits that keep every party (a list of player indexes) on one team
+    allowed = np.ones(len(SPLIT_MASKS), dtype=bool)
+    for party in parties:
+        on_alpha = SPLIT_MASKS[:, party]
+        allowed &= on_alpha.all(axis=1) | ~on_alpha.any(axis=1)
+    return allowed
+
+
+def best_splits(ratings, deviations, allowed=None):
+    """The most even split of each lobby and its quality.
+
+    Returns the index into ALPHA_SPLITS / BRAVO_SPLITS and the quality for
+    each lobby, 1 for an even match down to 0 for a certain one. allowed is
+    an optional (35,) or (lobbies, 35) mask of splits that may be used.
+    """
+    quality = 1 - 2 * np.abs(win_probabilities(ratings, deviations) - 0.5)
+    if allowed is not None:
+        quality = np.where(allowed, quality, -1)
+    best = np.argmax(quality, axis=-1)
+    return best, np.take_along_axis(quality, best[..., None], axis=-1)[..., 0]
+
+
+def balance_teams(ratings, deviations, parties=(), host=None):
+    """Split one lobby of 8 players into the most even teams.
+
+    parties are lists of player indexes that must be on the same team and
+    host is the index of a player to put on alpha. Returns the alpha and
+    bravo player indexes and the quality of the split.
+    """
+    allowed = allowed_splits(parties)
+    if not allowed.any():
+        raise ValueError("The parties can't be split into two teams.")
+
+    best, quality = best_splits(np.asarray(ratings)[None], np.asarray(deviations)[None], allowed)
+    alpha = ALPHA_SPLITS[best[0]].tolist()
+    bravo = BRAVO_SPLITS[best[0]].tolist()
+    if host is not None and host not in alpha:
+        alpha, bravo = bravo, alpha
+    return alpha, bravo, float(quality[0])
@@ -0,0 +1,63 @@
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate
+import random
+import pytest
+
+from maplist_utils import Maplist, _WeightTree, generate_maps, generate_seeded_maps, MAPLIST_LUCK
+
+MAP_KEY = {map: map for map in ("reef", "mako", "port", "arena", "bridge")}
+MODE_KEY = {mode: mode for mode in ("sz", "tc", "rm")}
+DATA = {
+    "reef": {"sz": 1, "tc": 2},
+    "mako": {"sz": 2, "rm": 1},
+    "port": {"sz": 3, "tc": 1, "rm": 2},
+    "arena": {"tc": 3, "rm": 1},
+    "bridge": {"sz": 1, "tc": 1, "rm": 3},
+}
+
+
+def test_find_matches_cumulative_weights():
+    weights = [3, 0, 5, 1, 0, 0, 8, 2]
+    tree = _WeightTree(weights)
+    totals = list(accumulate(weights))
+    for target in range(sum(weights)):
+        assert tree.find(target) == bisect_right(totals, target)
+
+    tree.add(2, -5)
+    weights[2] = 0
+    totals = list(accumulate(weights))
+    for target in range(sum(weights)):
+        assert tree.find(target) == bisect_right(totals, target)
+
+
+def test_odds_match_copy_pools():
+    maplist = Maplist("test", DATA, MAP_KEY, MODE_KEY)
+    rng = random.Random(9)
+    draws = 50000
+    counts = Counter(generate_maps(maplist, ["sz"], rng=rng)[0][0] for i in range(draws))
+
+    weights = {map: DATA[map].get("sz", 0) ** MAPLIST_LUCK for map in DATA}
+    total = sum(weights.values())
+    for map, weight in weights.items():
+        assert counts[map] / draws == pytest.approx(weight / total, abs=0.01)
+
+
+def test_maps_are_not_repeated():
+    maplist = Maplist("test", DATA, MAP_KEY, MODE_KEY)
+    for seed in range(200):
+        maps, modes = generate_seeded_maps(maplist, ["sz", "tc", "rm", "sz"], seed)
+        assert len(set(maps)) == 4 # picked maps leave every pool, not only their own mode's
+        for map, mode in zip(maps, modes):
+            assert DATA[map].get(mode, 0) > 0
+
+
+def test_same_seed_same_maps():
+    maplist = Maplist("test", DATA, MAP_KEY, MODE_KEY)
+    assert generate_seeded_maps(maplist, ["sz", "tc", "rm"], 42) == generate_seeded_maps(maplist, ["sz", "tc", "rm"], 42)
+
+
+def test_running_out_of_maps_raises():
+    maplist = Maplist("test", DATA, MAP_KEY, MODE_KEY)
+    with pytest.raises(ValueError):
+        generate_maps(maplist, ["sz"] * 5) # only 4 maps have sz
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+from queue_engine import QueueEngine, SearchCurve
+
+MODE = "splat_zones"
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakePool:
+    # records queue table writes instead of running them
+    def __init__(self):
+        self.queries = []
+
+    async def execute(self, query, *args):
+        self.queries.append((query, args))
+
+
+def add_group(engine, player_ids, rating=1500.0, join_date=START):
+    ratings = {(player_id, MODE): rating for player_id in player_ids}
+    group = engine.build_group(player_ids, [MODE], join_date, ratings)
+    engine.add(group)
+    return group
+
+
+def match_ids(match):
+    return sorted(player_id for group in match for player_id in group.player_ids)
+
+
+def test_released_group_is_matched_again():
+    engine = QueueEngine()
+    pool = FakePool()
+    for player_id in range(8):
+        add_group(engine, [player_id])
+
+    matches = engine.pop_matches(MODE, START)
+    assert [match_ids(match) for match in matches] == [list(range(8))]
+    assert engine.pop_matches(MODE, START + timedelta(minutes=1)) == [] # reserved
+
+    asyncio.run(engine.release(pool, list(range(8))))
+    assert "available = true" in pool.queries[-1][0]
+    matches = engine.pop_matches(MODE, START + timedelta(minutes=1))
+    assert [match_ids(match) for match in matches] == [list(range(8))]
+
+
+def test_reserve_and_dequeue_are_mirrored():
+    engine = QueueEngine()
+    pool = FakePool()
+    for player_id in range(9):
+        add_group(engine, [player_id])
+
+    asyncio.run(engine.reserve(pool, [0]))
+    assert not engine.get(0).available
+    match, = engine.pop_matches(MODE, START)
+    assert match_ids(match) == list(range(1, 9))
+
+    asyncio.run(engine.dequeue(pool, list(range(1, 9))))
+    assert len(engine) == 1 and engine.get(1) is None
+
+
+def test_release_all_frees_every_reservation():
+    engine = QueueEngine()
+    pool = FakePool()
+    for player_id in range(8):
+        add_group(engine, [player_id])
+    engine.set_available(list(range(8)), False)
+
+    asyncio.run(engine.release_all(pool))
+    assert all(group.available for group in engine.groups.values())
+    assert len(engine.pop_matches(MODE, START)) == 1
+
+
+def first_match_time(engine, curve, start, end):
+    # poll like the matchmaker does, every second
+    now = start
+    while now <= end:
+        if engine.pop_matches(MODE, now, curve):
+            return now
+        now += timedelta(seconds=1)
+    return None
+
+
+def test_matches_once_the_range_has_grown():
+    engine = QueueEngine()
+    curve = SearchCurve(200, 25, 600) # 300 after 4 minutes
+    for player_id in range(4):
+        add_group(engine, [player_id], 1500)
+    for player_id in range(4, 8):
+        add_group(engine, [player_id], 1800)
+
+    assert first_match_time(engine, curve, START, START + timedelta(minutes=10)) == START + timedelta(minutes=4)
+
+
+def test_ranges_must_cover_each_other():
+    engine = QueueEngine()
+    curve = SearchCurve(200, 25, 600)
+    joined = START + timedelta(minutes=16)
+    for player_id in range(4):
+        add_group(engine, [player_id], 1500) # range 600 when the others join
+    for player_id in range(4, 8):
+        add_group(engine, [player_id], 1800, joined)
+
+    assert first_match_time(engine, curve, joined, joined + timedelta(minutes=10)) == joined + timedelta(minutes=4)
+
+
+def test_unsplittable_parties_are_skipped():
+    engine = QueueEngine()
+    add_group(engine, [0, 1, 2])
+    add_group(engine, [3, 4, 5])
+    add_group(engine, [6, 7]) # 3 + 3 + 2 can't be split 4 / 4
+    assert engine.pop_matches(MODE, START) == []
+
+    add_group(engine, [8])
+    add_group(engine, [9])
+    match, = engine.pop_matches(MODE, START)
+    assert match_ids(match) == [0, 1, 2, 3, 4, 5, 8, 9]
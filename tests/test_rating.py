@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from glicko2 import Player
+
+from rating_utils import create_player, worth_playing
+from rating_batch import score_lobbies
+
+
+def random_lobbies(rng, count):
+    ratings = rng.normal(1500, 250, (count, 8))
+    deviations = rng.uniform(30, 350, (count, 8))
+    volatilities = rng.uniform(0.04, 0.09, (count, 8))
+    return ratings, deviations, volatilities
+
+
+def worth_playing_changes(ratings, deviations, volatilities):
+    # each player's rating change the way worth_playing rates them, without stopping at the first loss
+    changes = []
+    for i in range(8):
+        team = i // 4
+        teammates = [j for j in range(team * 4, team * 4 + 4) if j != i]
+        opponents = list(range((1 - team) * 4, (1 - team) * 4 + 4))
+        RD_list = [deviations[j] for j in teammates + opponents]
+        rating_list, rd_list, outcome_list = create_player(
+            sum(ratings[j] for j in teammates), sum(ratings[j] for j in opponents), RD_list, 3, 1
+        )
+        player = Player(rating=ratings[i], rd=deviations[i], vol=volatilities[i])
+        player.update_player(rating_list, rd_list, outcome_list)
+        changes.append(player.rating - ratings[i])
+    return changes
+
+
+def test_score_lobbies_matches_worth_playing():
+    rng = np.random.default_rng(24)
+    ratings, deviations, volatilities = random_lobbies(rng, 200)
+    changes, quality = score_lobbies(ratings, deviations, volatilities)
+
+    for lobby in range(len(ratings)):
+        players = [Player(rating=r, rd=rd, vol=vol) for r, rd, vol in zip(ratings[lobby], deviations[lobby], volatilities[lobby])]
+        assert worth_playing(players) == (quality[lobby] >= 0)
+        assert changes[lobby] == pytest.approx(worth_playing_changes(ratings[lobby], deviations[lobby], volatilities[lobby]), abs=1e-9)
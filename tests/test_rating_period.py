@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from glicko2 import Player
+
+from rating_utils import period_sums, rate_period
+from rating_batch import rate_periods
+
+
+@pytest.mark.parametrize("games", [1, 5, 60])
+def test_rate_period_matches_update_player(games):
+    rng = np.random.default_rng(games)
+    for i in range(50):
+        rating, deviation, volatility = rng.normal(1500, 300), rng.uniform(30, 350), rng.uniform(0.04, 0.09)
+        rating_list = rng.normal(1500, 300, games).tolist()
+        rd_list = rng.uniform(30, 350, games).tolist()
+        outcome_list = rng.integers(0, 2, games).tolist()
+
+        player = Player(rating=rating, rd=deviation, vol=volatility)
+        player.update_player(rating_list, rd_list, outcome_list)
+
+        # close_game adds each game's sums to the period's
+        variance_sum = improvement_sum = 0
+        for game in zip(rating_list, rd_list, outcome_list):
+            game_variance, game_improvement = period_sums(rating, *([value] for value in game))
+            variance_sum += game_variance
+            improvement_sum += game_improvement
+
+        expected = (player.rating, player.rd, player.vol)
+        assert rate_period(rating, deviation, volatility, variance_sum, improvement_sum) == pytest.approx(expected, rel=1e-9)
+        assert period_sums(rating, rating_list, rd_list, outcome_list) == pytest.approx((variance_sum, improvement_sum), rel=1e-9)
+
+        batch = rate_periods([rating], [deviation], [volatility], [variance_sum], [improvement_sum])
+        assert [float(values[0]) for values in batch] == pytest.approx(expected, rel=1e-9)
+
+
+def test_rate_period_without_games():
+    assert rate_period(1600.0, 80.0, 0.06, 0, 0) == (1600.0, 80.0, 0.06)
@@ -0,0 +1,55 @@
+import pytest
+
+from team_balance import allowed_splits, balance_teams
+from queue_engine import can_split
+
+
+def partitions(total, largest=4):
+    # every way to make total players out of parties of up to largest
+    if total == 0:
+        yield []
+        return
+    for size in range(min(total, largest), 0, -1):
+        for rest in partitions(total - size, size):
+            yield [size] + rest
+
+
+def parties_of(sizes):
+    parties = []
+    start = 0
+    for size in sizes:
+        parties.append(list(range(start, start + size)))
+        start += size
+    return parties
+
+
+def test_even_lobby_has_quality_one():
+    ratings = [1900, 1100, 1500, 1500, 1700, 1300, 1600, 1400]
+    alpha, bravo, quality = balance_teams(ratings, [100] * 8)
+    assert sum(ratings[i] for i in alpha) == sum(ratings[i] for i in bravo)
+    assert quality == pytest.approx(1.0)
+
+
+def test_parties_stay_together():
+    ratings = [2000, 1990, 1000, 1010, 1500, 1500, 1500, 1500]
+    parties = [[0, 1], [2, 3, 4]]
+    alpha, bravo, quality = balance_teams(ratings, [100] * 8, parties)
+    assert sorted(alpha + bravo) == list(range(8))
+    for party in parties:
+        assert set(party) <= set(alpha) or set(party) <= set(bravo)
+
+
+@pytest.mark.parametrize("host", range(8))
+def test_host_is_on_alpha(host):
+    alpha, bravo, quality = balance_teams([1500 + 50 * i for i in range(8)], [100] * 8, host=host)
+    assert host in alpha
+
+
+def test_unsplittable_parties_raise():
+    with pytest.raises(ValueError):
+        balance_teams([1500] * 8, [100] * 8, [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+
+@pytest.mark.parametrize("sizes", list(partitions(8)))
+def test_can_split_agrees_with_allowed_splits(sizes):
+    assert can_split(sizes) == bool(allowed_splits(parties_of(sizes)).any())